@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 by bgeneto <b g e n e t o @ g m a i l . c o m>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__doc__ = """
+End-to-end benchmark of the acquisition and post-processing pipeline.
+
+Runs complete experiments against the simulated LCR meter and arduino
+boards (see the 'simulator' package) across a grid of valves, sensors,
+loops and read durations, then saves the results as json so runs can be
+compared across versions:
+
+    python3 benchmark.py --valves 1,4 --sensors 1,8 --durations 1,3 -o bench.json
+
+Unless --wall-clock is given, acquisition runs on a virtual clock, so the
+reported acquisition times are the ones a real rig would take while the
+benchmark itself only takes a fraction of it.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import clocks
+import devices
+import exporter
+import mycfg
+import storage
+from simulator.board import FakeBoard
+
+__author__ = "bgeneto"
+__copyright__ = "Copyright 2022, bgeneto"
+__credits__ = ["bgeneto"]
+__license__ = "GPL"
+__maintainer__ = "Bernhard Enders"
+__email__ = "b g e n e t o @ d u c k . c o m"
+__version__ = "1.0.0"
+__modified__ = "20261016"
+
+DEFAULT_URL = 'th2816b://?seed=1'
+
+# arduino mega pins used by the simulated rig
+VALVES_FIRST_PIN = 22
+SENSORS_FIRST_PIN = 2
+MAX_POSITIONS = 8
+
+
+def peak_rss_mb():
+    '''peak resident set size of this process in MiB'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos reports bytes
+    if sys.platform == 'darwin':
+        return rss/1024**2
+    return rss/1024
+
+
+def rig_config(cfg_file, nvalves, nsensors, opts):
+    '''create a config file for a simulated rig (one or two arduinos)'''
+    cfg = mycfg.MyConfig(cfg_file)
+    valves = [str(VALVES_FIRST_PIN + idx) for idx in range(nvalves)]
+    sensors = [str(SENSORS_FIRST_PIN + idx) for idx in range(nsensors)]
+    valves += ['']*(MAX_POSITIONS - nvalves)
+    sensors += ['']*(MAX_POSITIONS - nsensors)
+    config = {'serial': {}, 'acquisition': {}, 'arduino1': {}, 'arduino2': {}}
+    config['serial']['port'] = opts.url
+    config['acquisition']['switch_delay'] = str(opts.switch_delay)
+    config['acquisition']['dwell_samples'] = str(opts.dwell_samples)
+    config['acquisition']['dwell_rstd'] = str(opts.dwell_rstd)
+    config['acquisition']['valve_settle'] = str(opts.valve_settle)
+    config['acquisition']['pipeline'] = '1' if opts.pipeline else '0'
+    config['acquisition']['interlocks'] = opts.interlocks
+    config['arduino1']['model'] = 'MEGA'
+    config['arduino1']['sensors'] = ';'.join(sensors)
+    if opts.boards == 2:
+        # valves on a second arduino
+        config['arduino2']['model'] = 'MEGA'
+        config['arduino2']['valves'] = ';'.join(valves)
+    else:
+        config['arduino1']['valves'] = ';'.join(valves)
+    cfg.update(config)
+
+    return cfg
+
+
+def timed(result, name, func, *args):
+    '''call func(*args) storing its run time in result[name]'''
+    start = time.perf_counter()
+    ret = func(*args)
+    result[name] = time.perf_counter() - start
+    return ret
+
+
+def run_case(workdir, nvalves, nsensors, vloop, sloop, stime, opts,
+             renderer=None):
+    '''run (and export) a single simulated experiment'''
+    case = f'V{nvalves}-S{nsensors}-VL{vloop}-SL{sloop}-D{stime}'
+    case_dir = os.path.join(workdir, case)
+    base_dir = os.path.join(case_dir, 'experiments')
+    output_dir = os.path.join(base_dir, 'run')
+    for subdir in ['primary', 'secondary']:
+        os.makedirs(os.path.join(output_dir, subdir), exist_ok=True)
+
+    cfg = rig_config(os.path.join(case_dir, 'config.ini'),
+                     nvalves, nsensors, opts)
+    clock = clocks.WallClock() if opts.wall_clock else clocks.VirtualClock()
+    previous_clock = clocks.set_clock(clock)
+    result = dict(case=case, valves=nvalves, sensors=nsensors,
+                  vloop=vloop, sloop=sloop, stime=stime)
+    try:
+        arduinos = devices.arduinos_connect(cfg, backend=FakeBoard)
+        lcr = devices.SerialConnection(cfg)
+        scheduler = devices.PipelinedScheduler.from_config(cfg)
+        writer = storage.ReadingsWriter.from_config(cfg, output_dir)
+        start, real_start = clock.monotonic(), time.perf_counter()
+        try:
+            devices.run_experiment(lcr, arduinos, vloop, sloop, stime,
+                                   dwell=devices.Dwell.from_config(cfg),
+                                   valve_settle=opts.valve_settle,
+                                   scheduler=scheduler, writer=writer)
+        finally:
+            writer.close()
+            devices.shutdown(lcr, arduinos)
+        acquisition = clock.monotonic() - start
+        real_acquisition = time.perf_counter() - real_start
+        switching = sum(arduino.switching_time
+                        for arduino in arduinos.values())
+        invalid = lcr.protocol.samples.invalid
+    finally:
+        clocks.set_clock(previous_clock)
+
+    start = time.perf_counter()
+    storage.write_columnar(output_dir, remove_stream=True)
+    result['store_s'] = time.perf_counter() - start
+    result['store_mb'] = dir_size(os.path.join(output_dir, storage.RESULTS_DIR))/1024**2
+    start = time.perf_counter()
+    stored = storage.ColumnarResults(output_dir)
+    result['load_s'] = time.perf_counter() - start
+
+    slots = vloop*nvalves*sloop*nsensors
+    samples = stored.manifest['samples']
+    dwell = float(stored.slots['dwell'].sum())
+    result.update(
+        slots=slots,
+        samples=samples,
+        invalid_lines=invalid,
+        acquisition_s=acquisition,
+        acquisition_real_s=real_acquisition,
+        dwell_per_slot_s=dwell/slots,
+        overhead_per_slot_s=(acquisition - dwell)/slots,
+        switching_per_slot_s=switching/slots,
+        samples_per_s=samples/acquisition if acquisition > 0 else 0.0,
+        experiments_per_hour=3600.0/acquisition if acquisition > 0 else 0.0,
+        pipeline_saved_s=sum(scheduler.saved) if scheduler else 0.0,
+    )
+
+    if not opts.no_export:
+        table = timed(result, 'table_s', exporter.tidy_table, stored)
+        timed(result, 'each_sensor_s', exporter.write_each_sensor,
+              table, output_dir)
+        timed(result, 'all_sensors_s', exporter.write_all_sensors,
+              table, output_dir)
+        timed(result, 'index_s', exporter.update_output_dir, base_dir)
+        # plots are rendered on request, time rendering all of them once
+        timed(result, 'plots_s', render_plots, output_dir, renderer, result)
+
+    result['peak_rss_mb'] = peak_rss_mb()
+
+    return result
+
+
+def render_plots(output_dir, renderer, result):
+    '''render every plot of an experiment (in process without a renderer)'''
+    plots = [(param, os.path.splitext(name)[0])
+             for param in exporter.PARAMS
+             for name in sorted(os.listdir(os.path.join(output_dir, param)))
+             if name.endswith('.csv')]
+    if renderer is None:
+        times = [exporter.plot_html(output_dir, param, name)[1]
+                 for param, name in plots]
+    else:
+        times = [future.result()[1] for future in
+                 [renderer.render(output_dir, param, name) for param, name in plots]]
+    result['plots'] = len(plots)
+    result['plot_max_s'] = max(times, default=0.0)
+
+
+def dir_size(path):
+    '''total size of the files in a directory'''
+    return sum(entry.stat().st_size for entry in os.scandir(path)
+               if entry.is_file())
+
+
+def int_list(value):
+    return [int(val) for val in value.split(',') if len(val) > 0]
+
+
+def add_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the acquisition and export pipeline against simulated devices.')
+    parser.add_argument('--valves', type=int_list, default=[1, 4],
+                        help='comma separated number of valves (default: 1,4)')
+    parser.add_argument('--sensors', type=int_list, default=[1, 8],
+                        help='comma separated number of sensors (default: 1,8)')
+    parser.add_argument('--vloops', type=int_list, default=[1],
+                        help='comma separated number of valve loops (default: 1)')
+    parser.add_argument('--sloops', type=int_list, default=[1, 8],
+                        help='comma separated number of sensor loops (default: 1,8)')
+    parser.add_argument('--durations', type=int_list, default=[3],
+                        help='comma separated read durations in seconds (default: 3)')
+    parser.add_argument('--url', default=DEFAULT_URL,
+                        help=f'simulated lcr meter url (default: {DEFAULT_URL})')
+    parser.add_argument('--switch-delay', type=float, default=0.1,
+                        help='delay between arduino port writes (default: 0.1)')
+    parser.add_argument('--dwell-samples', type=int, default=0,
+                        help='adaptive dwell: end a slot after this many samples (default: off)')
+    parser.add_argument('--dwell-rstd', type=float, default=0.0,
+                        help='adaptive dwell: end a slot once the relative std is below this (default: off)')
+    parser.add_argument('--boards', type=int, choices=[1, 2], default=1,
+                        help='number of arduinos, valves on the second one (default: 1)')
+    parser.add_argument('--valve-settle', type=float, default=0.0,
+                        help='valve settle time in seconds (default: 0)')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='overlap valves and sensors actuation (requires --boards 2)')
+    parser.add_argument('--interlocks', default='valves:read',
+                        help='comma separated pipeline interlocks (default: valves:read)')
+    parser.add_argument('--workdir', default=None,
+                        help='where to write the experiments (default: temporary dir)')
+    parser.add_argument('--output', '-o', default='bench_output.json',
+                        help='json results file (default: bench_output.json)')
+    parser.add_argument('--plot-workers', type=int, default=0,
+                        help='render plots in this many worker processes (default: 0, in process)')
+    parser.add_argument('--no-export', action='store_true',
+                        help='only benchmark the acquisition')
+    parser.add_argument('--wall-clock', action='store_true',
+                        help='run in real time instead of on a virtual clock')
+
+    return parser
+
+
+def main(argv):
+    opts = add_args().parse_args(argv)
+    workdir = opts.workdir or tempfile.mkdtemp(prefix='th2816b-bench-')
+
+    renderer = None
+    if opts.plot_workers > 0 and not opts.no_export:
+        renderer = exporter.PlotRenderer(opts.plot_workers)
+
+    results = []
+    grid = itertools.product(opts.valves, opts.sensors, opts.vloops,
+                             opts.sloops, opts.durations)
+    for nvalves, nsensors, vloop, sloop, stime in grid:
+        if not 0 < nvalves <= MAX_POSITIONS or not 0 < nsensors <= MAX_POSITIONS:
+            print(f'Skipping {nvalves} valves x {nsensors} sensors (max. {MAX_POSITIONS})')
+            continue
+        results.append(run_case(workdir, nvalves, nsensors,
+                                vloop, sloop, stime, opts, renderer))
+    if renderer is not None:
+        renderer.shutdown()
+
+    report = dict(version=devices.__version__,
+                  date=time.strftime("%Y-%m-%d %H:%M:%S"),
+                  python=platform.python_version(),
+                  platform=platform.platform(),
+                  clock='wall' if opts.wall_clock else 'virtual',
+                  url=opts.url,
+                  switch_delay=opts.switch_delay,
+                  plot_workers=opts.plot_workers,
+                  workdir=workdir,
+                  results=results)
+    with open(opts.output, 'w', encoding='UTF-8') as outfile:
+        json.dump(report, outfile, indent=2)
+
+    print(f"\n{'case':<24}{'exp/h':>8}{'ovh/slot':>10}{'smp/s':>8}"
+          f"{'export':>9}{'index':>8}{'plots':>8}{'rss':>8}")
+    for res in results:
+        export = res['store_s'] + res.get('table_s', 0) + \
+            res.get('each_sensor_s', 0) + \
+            res.get('all_sensors_s', 0)
+        print(f"{res['case']:<24}{res['experiments_per_hour']:>8.1f}"
+              f"{res['overhead_per_slot_s']:>10.3f}{res['samples_per_s']:>8.2f}"
+              f"{export:>9.2f}{res.get('index_s', 0):>8.2f}"
+              f"{res.get('plots_s', 0):>8.2f}{res['peak_rss_mb']:>8.1f}")
+    print(f'\nResults saved to {opts.output}')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 by bgeneto <b g e n e t o @ g m a i l . c o m>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__doc__ = """
+SQLite catalog of the finished experiments.
+
+One row per experiment (user, description, start and end time, valve and
+sensor layout, sample counts and files) plus one row per slot with the
+summary statistics of its readings, so experiments can be searched by
+user, date or sensor without walking the experiments directory:
+
+    catalog = Catalog('catalog.sqlite', 'experiments')
+    catalog.add(output_dir)
+    catalog.search(user='bgeneto', since='2026-10-01', sensor='S3')
+
+Valves and sensors are kept with the one based labels of the csv files,
+plots and index pages (V1, S1...), not the zero based names of the
+columnar store (V0, S0...).
+
+Experiments are read from their columnar store (see storage.py). Existing
+experiments (old results.json files are converted first) are added with:
+
+    python3 catalog.py experiments/
+
+Classes:
+
+    Catalog
+
+Functions:
+
+    display_label(name)
+    slot_stats(results, param)
+    add_args()
+    main(argv)
+
+Misc variables:
+
+    __version__
+    __author__
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import indexer
+import storage
+
+__author__ = "bgeneto"
+__copyright__ = "Copyright 2022, bgeneto"
+__credits__ = ["bgeneto"]
+__license__ = "GPL"
+__maintainer__ = "Bernhard Enders"
+__email__ = "b g e n e t o @ d u c k . c o m"
+__version__ = "1.0.0"
+__modified__ = "20261016"
+
+CATALOG_FILE = 'catalog.sqlite'
+# experiment directory names (see create_output_dir)
+DIR_TIME_FORMAT = '%Y-%m-%d %Hh%Mm%Ss'
+STATS = ('mean', 'std', 'min', 'max')
+# PRAGMA user_version, 1: one based valve and sensor labels
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS experiments (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    user TEXT NOT NULL,
+    description TEXT,
+    start_time REAL,
+    end_time REAL,
+    valves TEXT NOT NULL,
+    sensors TEXT NOT NULL,
+    cycles INTEGER NOT NULL,
+    slots INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    files TEXT NOT NULL,
+    store_mtime INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS experiments_user ON experiments (user, start_time);
+CREATE INDEX IF NOT EXISTS experiments_start ON experiments (start_time);
+CREATE TABLE IF NOT EXISTS slots (
+    experiment_id INTEGER NOT NULL REFERENCES experiments (id),
+    cycle INTEGER NOT NULL,
+    valve TEXT NOT NULL,
+    sensor TEXT NOT NULL,
+    loop INTEGER NOT NULL,
+    time REAL,
+    dwell REAL,
+    count INTEGER NOT NULL,
+    primary_mean REAL, primary_std REAL, primary_min REAL, primary_max REAL,
+    secondary_mean REAL, secondary_std REAL, secondary_min REAL, secondary_max REAL
+);
+CREATE INDEX IF NOT EXISTS slots_experiment ON slots (experiment_id);
+CREATE INDEX IF NOT EXISTS slots_sensor ON slots (sensor, valve);
+"""
+
+
+def display_label(name):
+    '''one based label of a columnar store name, as shown in the csv
+       files and plots (V0 -> V1, S0 -> S1)'''
+    try:
+        return f'{name[0]}{int(name[1:]) + 1}'
+    except (IndexError, ValueError):
+        return name
+
+
+def _none(values):
+    '''numpy values to a list, nan (no finite samples) to None'''
+    return [float(val) if np.isfinite(val) else None for val in values]
+
+
+def slot_stats(results, param):
+    '''mean, std, min and max of the finite samples of every slot of a
+       storage.ColumnarResults (None for slots without finite samples)'''
+    slots = results.slots
+    values = np.asarray(results.columns[param])
+    finite = np.isfinite(values)
+    slot_id = np.repeat(np.arange(len(slots)), slots['count'])
+    counts = np.bincount(slot_id, weights=finite, minlength=len(slots))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(slot_id, weights=np.where(finite, values, 0),
+                           minlength=len(slots)) / counts
+        dev = np.where(finite, values - mean[slot_id], 0)
+        std = np.sqrt(np.bincount(slot_id, weights=dev**2,
+                                  minlength=len(slots)) / counts)
+    vmin = np.full(len(slots), np.inf)
+    vmax = np.full(len(slots), -np.inf)
+    np.minimum.at(vmin, slot_id[finite], values[finite])
+    np.maximum.at(vmax, slot_id[finite], values[finite])
+
+    return {'mean': _none(mean), 'std': _none(std),
+            'min': _none(vmin), 'max': _none(vmax)}
+
+
+class Catalog:
+    '''Experiments catalog in the sqlite file path, experiment paths are
+       kept relative to base_dir. A connection is opened per call, so a
+       Catalog can be shared by the web server threads'''
+
+    def __init__(self, path=CATALOG_FILE, base_dir='experiments'):
+        self.path = path
+        self.base_dir = os.path.abspath(base_dir)
+        with self.__connect() as db:
+            # readers are not blocked while an experiment is added
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+            if db.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                self.__relabel(db)
+                db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def __relabel(self, db):
+        '''catalogs written before SCHEMA_VERSION 1 kept the zero based
+           store names'''
+        db.create_function('display_label', 1, display_label)
+        db.create_function('display_labels', 1, lambda names: json.dumps(
+            [display_label(name) for name in json.loads(names)]))
+        db.execute('UPDATE experiments SET valves = display_labels(valves),'
+                   ' sensors = display_labels(sensors)')
+        db.execute('UPDATE slots SET valve = display_label(valve),'
+                   ' sensor = display_label(sensor)')
+
+    @contextlib.contextmanager
+    def __connect(self):
+        '''a connection, committed (or rolled back) and closed on exit'''
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _relpath(self, output_dir):
+        return os.path.relpath(os.path.abspath(output_dir),
+                               self.base_dir).replace(os.sep, '/')
+
+    def add(self, output_dir, user=None, description=None):
+        '''add (or replace) the experiment in output_dir, the user defaults
+           to its parent directories and the description to desc.txt'''
+        results = storage.ColumnarResults(output_dir)
+        path = self._relpath(output_dir)
+        if user is None:
+            user = path.rpartition('/')[0]
+        if description is None:
+            desc_file = os.path.join(output_dir, 'desc.txt')
+            if os.path.isfile(desc_file):
+                with open(desc_file, 'r', encoding='UTF-8') as f:
+                    description = f.read()
+
+        slots = results.slots
+        times = slots['time'][np.isfinite(slots['time'])]
+        if len(times):
+            starts = slots['time'] - np.nan_to_num(slots['dwell'])
+            start_time = float(np.nanmin(starts))
+            end_time = float(times.max())
+        else:
+            # converted results.json files have no timestamps
+            try:
+                start_time = time.mktime(time.strptime(
+                    os.path.basename(os.path.abspath(output_dir)), DIR_TIME_FORMAT))
+            except ValueError:
+                start_time = None
+            end_time = None
+        # data files only, not the generated index pages
+        files = sorted(os.path.relpath(os.path.join(root, name), output_dir).replace(os.sep, '/')
+                       for root, _, names in os.walk(output_dir) for name in names
+                       if name not in (indexer.DEFAULT_OUTPUT_FILE, indexer.MANIFEST_FILE))
+        store_mtime = os.stat(os.path.join(
+            results.path, storage.MANIFEST_FILE)).st_mtime_ns
+
+        stats = {param: slot_stats(results, param) for param in storage.PARAMS}
+        valves = [display_label(name) for name in results.valves]
+        sensors = [display_label(name) for name in results.sensors]
+        rows = zip(slots['cycle'].tolist(),
+                   [valves[idx] for idx in slots['valve']],
+                   [sensors[idx] for idx in slots['sensor']],
+                   slots['loop'].tolist(), _none(slots['time']),
+                   _none(slots['dwell']), slots['count'].tolist(),
+                   *(stats[param][stat] for param in storage.PARAMS for stat in STATS))
+
+        with self.__connect() as db:
+            self.__remove(db, path)
+            cursor = db.execute(
+                'INSERT INTO experiments (path, user, description, start_time,'
+                ' end_time, valves, sensors, cycles, slots, samples, files,'
+                ' store_mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, user, description, start_time, end_time,
+                 json.dumps(valves), json.dumps(sensors),
+                 int(slots['cycle'].max()) + 1 if len(slots) else 0,
+                 len(slots), int(slots['count'].sum()), json.dumps(files),
+                 store_mtime))
+            db.executemany(
+                'INSERT INTO slots VALUES (?, ?, ?, ?, ?, ?, ?, ?,'
+                ' ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((cursor.lastrowid, *row) for row in rows))
+
+        return path
+
+    def __remove(self, db, path):
+        db.execute('DELETE FROM slots WHERE experiment_id IN'
+                   ' (SELECT id FROM experiments WHERE path = ?)', (path,))
+        db.execute('DELETE FROM experiments WHERE path = ?', (path,))
+
+    def remove(self, output_dir):
+        with self.__connect() as db:
+            self.__remove(db, self._relpath(output_dir))
+
+    def store_mtime(self, output_dir):
+        '''mtime of the columnar store when the experiment was added'''
+        with self.__connect() as db:
+            row = db.execute('SELECT store_mtime FROM experiments WHERE path = ?',
+                             (self._relpath(output_dir),)).fetchone()
+        return None if row is None else row['store_mtime']
+
+    def search(self, user=None, since=None, until=None, sensor=None,
+               text=None, limit=100, offset=0):
+        '''experiments (newest first) of user, started between since and
+           until (datetimes, iso strings or unix times), that read sensor
+           and whose description contains text'''
+        where, args = [], []
+        if user is not None:
+            where.append('user = ?')
+            args.append(user)
+        for op, value in (('>=', since), ('<', until)):
+            if value is not None:
+                where.append(f'start_time {op} ?')
+                args.append(_timestamp(value))
+        if sensor is not None:
+            where.append('id IN (SELECT experiment_id FROM slots WHERE sensor = ?)')
+            args.append(sensor)
+        if text:
+            where.append('description LIKE ?')
+            args.append(f'%{text}%')
+        sql = ' WHERE ' + ' AND '.join(where) if where else ''
+        with self.__connect() as db:
+            total = db.execute(f'SELECT COUNT(*) FROM experiments{sql}', args).fetchone()[0]
+            rows = db.execute(f'SELECT * FROM experiments{sql}'
+                              ' ORDER BY start_time DESC LIMIT ? OFFSET ?',
+                              args + [limit, offset]).fetchall()
+
+        return total, [_experiment(row) for row in rows]
+
+    def experiment_path(self, experiment_id):
+        '''path (relative to base_dir) of an experiment id, None if unknown'''
+        with self.__connect() as db:
+            row = db.execute('SELECT path FROM experiments WHERE id = ?',
+                             (experiment_id,)).fetchone()
+        return None if row is None else row['path']
+
+    def slots(self, path):
+        '''per slot statistics of an experiment (path relative to base_dir)'''
+        with self.__connect() as db:
+            rows = db.execute('SELECT slots.* FROM slots JOIN experiments'
+                              ' ON experiments.id = slots.experiment_id'
+                              ' WHERE experiments.path = ? ORDER BY slots.rowid',
+                              (path,)).fetchall()
+
+        return [{key: row[key] for key in row.keys() if key != 'experiment_id'}
+                for row in rows]
+
+    def backfill(self, force=False, log=print):
+        '''add every experiment under base_dir that is not in the catalog
+           yet (or changed since it was added). Old experiments with a
+           results.json file only are converted to the columnar store first'''
+        added = 0
+        for root, dirs, files in os.walk(self.base_dir):
+            dirs.sort()
+            manifest = os.path.join(root, storage.RESULTS_DIR, storage.MANIFEST_FILE)
+            if not os.path.isfile(manifest):
+                if 'results.json' not in files:
+                    continue
+                try:
+                    storage.convert_results_json(os.path.join(root, 'results.json'))
+                    log(f'Converted {root} to the columnar store')
+                except (OSError, ValueError, KeyError, TypeError) as exc:
+                    log(f'ERROR: unable to convert {root}, skipped: {exc}')
+                    continue
+            if not force and self.store_mtime(root) == os.stat(manifest).st_mtime_ns:
+                continue
+            try:
+                log(f'Adding {self.add(root)}')
+                added += 1
+            except (OSError, ValueError, KeyError) as exc:
+                log(f'ERROR: unable to add {root}: {exc}')
+
+        return added
+
+
+def _timestamp(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+def _experiment(row):
+    exp = dict(row)
+    for key in ('valves', 'sensors', 'files'):
+        exp[key] = json.loads(exp[key])
+    for key in ('start_time', 'end_time'):
+        if exp[key] is not None:
+            exp[key] = datetime.fromtimestamp(exp[key]).isoformat(timespec='seconds')
+    del exp['store_mtime']
+
+    return exp
+
+
+def add_args():
+    parser = argparse.ArgumentParser(
+        description='Add existing experiments to the catalog (old results.json files are converted).')
+    parser.add_argument('base_dir', nargs='?', default='experiments',
+                        help='experiments directory (default: experiments)')
+    parser.add_argument('--db', default=CATALOG_FILE,
+                        help=f'catalog file (default: {CATALOG_FILE})')
+    parser.add_argument('--force', action='store_true',
+                        help='add experiments again even if unchanged')
+
+    return parser
+
+
+def main(argv):
+    opts = add_args().parse_args(argv)
+    catalog = Catalog(opts.db, opts.base_dir)
+    added = catalog.backfill(opts.force)
+    print(f'{added} experiment(s) added to {opts.db}')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
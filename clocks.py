@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 by bgeneto <b g e n e t o @ g m a i l . c o m>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__doc__ = """
+Pluggable clock used by the device layer.
+
+The device layer never calls time.sleep() directly but the module level
+functions below, so a simulated rig can fast-forward time:
+
+    clocks.set_clock(clocks.VirtualClock())
+
+Classes:
+
+    WallClock
+    VirtualClock
+
+Functions:
+
+    get_clock()
+    set_clock(clock)
+    sleep(secs)
+    monotonic()
+    time()
+    now()
+
+Misc variables:
+
+    __version__
+    __author__
+"""
+
+import threading
+import time as _time
+from datetime import datetime
+
+__author__ = "bgeneto"
+__copyright__ = "Copyright 2022, bgeneto"
+__credits__ = ["bgeneto"]
+__license__ = "GPL"
+__maintainer__ = "Bernhard Enders"
+__email__ = "b g e n e t o @ d u c k . c o m"
+__version__ = "1.0.0"
+__modified__ = "20261016"
+
+
+class WallClock:
+    '''Real time clock (the default)'''
+
+    def __init__(self):
+        self._listeners = []
+
+    def time(self):
+        return _time.time()
+
+    def monotonic(self):
+        return _time.monotonic()
+
+    def sleep(self, secs):
+        if secs > 0:
+            _time.sleep(secs)
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    def add_listener(self, callback):
+        '''callback(clock) is called every time the clock is fast-forwarded'''
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+
+class VirtualClock(WallClock):
+    '''Simulated clock: sleep() advances time instantly.
+       Simulated devices register a listener in order to produce
+       whatever is due before the sleeping thread resumes.
+    '''
+
+    def __init__(self, start=None):
+        super(VirtualClock, self).__init__()
+        self._epoch = _time.time() if start is None else start
+        self._elapsed = 0.0
+        self._lock = threading.RLock()
+
+    def time(self):
+        return self._epoch + self._elapsed
+
+    def monotonic(self):
+        return self._elapsed
+
+    def sleep(self, secs):
+        if secs <= 0:
+            return
+        with self._lock:
+            self._elapsed += secs
+            for callback in list(self._listeners):
+                callback(self)
+
+    def elapsed(self):
+        '''total (simulated) time slept so far'''
+        return self._elapsed
+
+
+# clock in use by the device layer
+_clock = WallClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    '''replace the clock in use, returns the previous one'''
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def sleep(secs):
+    _clock.sleep(secs)
+
+
+def monotonic():
+    return _clock.monotonic()
+
+
+def time():
+    return _clock.time()
+
+
+def now():
+    return _clock.now()
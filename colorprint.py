@@ -21,11 +21,13 @@ __doc__ = """
 Write message to standard output (stdout) or standard error (stderr).
 
 Message is outputted in color according to the message flavor/method requested.
-Can also write to a file in html format.
+Can also write to a file in html format. File writes are batched by a
+background thread (see FileSink), so logging never waits for the disk.
 
 Classes:
 
     ColorPrint
+    FileSink
 
 Functions:
 
@@ -37,6 +39,8 @@ Functions:
     bold(message, end)
     norm(message, end)
     light(message, end)
+    flush()
+    close()
 
 Misc variables:
 
@@ -44,8 +48,10 @@ Misc variables:
     __author__
 """
 
+import atexit
 import os
 import sys
+import threading
 
 __author__ = "bgeneto"
 __copyright__ = "Copyright 2022, bgeneto"
@@ -53,8 +59,84 @@ __credits__ = ["bgeneto"]
 __license__ = "GPL"
 __maintainer__ = "Bernhard Enders"
 __email__ = "b g e n e t o @ d u c k . c o m"
-__version__ = "1.0.1"
-__modified__ = "20220915"
+__version__ = "1.0.2"
+__modified__ = "20261016"
+
+
+class FileSink:
+    '''Appends text to a file from a background thread. Pending text is
+       written every flush_interval seconds, as soon as flush_bytes are
+       pending, on flush() and at exit. The file is renamed to file.1
+       (replacing it) when it would grow beyond max_bytes (zero: never)
+    '''
+
+    def __init__(self, filename, flush_interval=0.5, flush_bytes=64*1024,
+                 max_bytes=4*1024*1024):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_bytes = max_bytes
+        self._pending = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        # keeps batches in order when flush() races the writer thread
+        self._io_lock = threading.Lock()
+        # forked processes (e.g. plot workers) have no writer thread
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self.__run, name='FileSink', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, text):
+        if self._closed or os.getpid() != self._pid:
+            self.__append([text])
+            return
+        with self._cond:
+            self._pending.append(text)
+            self._size += len(text)
+            if self._size >= self.flush_bytes:
+                self._cond.notify()
+
+    def flush(self):
+        '''write the pending text now'''
+        with self._io_lock:
+            with self._cond:
+                batch = self._pending
+                self._pending = []
+                self._size = 0
+            self.__append(batch)
+
+    def close(self):
+        if self._closed or os.getpid() != self._pid:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def __run(self):
+        while not self._closed:
+            with self._cond:
+                if not self._closed and self._size < self.flush_bytes:
+                    self._cond.wait(self.flush_interval)
+            self.flush()
+
+    def __append(self, batch):
+        if not batch:
+            return
+        data = ''.join(batch)
+        try:
+            if self.max_bytes and os.path.isfile(self.filename):
+                if os.path.getsize(self.filename) + len(data) > self.max_bytes:
+                    os.replace(self.filename, self.filename + '.1')
+            with open(self.filename, 'a', encoding='UTF-8') as f:
+                f.write(data)
+        except OSError:
+            # a full or missing disk must not stop the acquisition
+            pass
 
 
 class ColorPrint:
@@ -65,10 +147,13 @@ class ColorPrint:
     def __init__(self, filename=None):
         # filename to log to
         self.filename = filename
-        # remove file at start
+        self.sink = None
+        # remove file (and its rotated copy) at start
         if self.filename is not None:
-            if os.path.isfile(self.filename):
-                os.remove(self.filename)
+            for fname in (self.filename, self.filename + '.1'):
+                if os.path.isfile(fname):
+                    os.remove(fname)
+            self.sink = FileSink(self.filename)
         # terminal colors to use
         self.term_postfix = '\x1b[0m'
         self.term_color = {'fail': '\x1b[1;31m',
@@ -105,11 +190,20 @@ class ColorPrint:
               end=end)
 
         # write to file
-        if self.filename is not None:
+        if self.sink is not None:
             html = self.html[flavor] + prefix + \
                 str(message) + self.html_end + end
-            with open(self.filename, 'a', encoding='UTF-8') as f:
-                f.write(html)
+            self.sink.write(html)
+
+    def flush(self):
+        '''write pending file output now'''
+        if self.sink is not None:
+            self.sink.flush()
+
+    def close(self):
+        '''write pending file output and stop the writer thread'''
+        if self.sink is not None:
+            self.sink.close()
 
     # available print methods
     def fail(self, message, end='\n'):
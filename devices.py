@@ -16,19 +16,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import copy
+import functools
 import os
 import sys
-import time
+import threading
 import traceback
-from datetime import datetime
 from enum import Enum
 from typing import Dict
 
+import numpy as np
 import serial
 from pymata4 import pymata4
 from serial.threaded import LineReader, ReaderThread
 
+import clocks
 from colorprint import ColorPrint
 
 __author__ = "Bernhard Enders"
@@ -44,6 +47,9 @@ __status__ = "Development"
 global_counter = 0
 cprint = ColorPrint(__name__ + '.log')
 
+# simulated devices url handlers (e.g. th2816b://)
+serial.protocol_handler_packages.append('simulator')
+
 
 class Board(Enum):
     '''arduino boards digital pins config'''
@@ -58,22 +64,30 @@ class ArduinoConnection:
        https://mryslab.github.io/pymata-express/firmata_express/#setting-the-firmataexpress-instance-id
     '''
 
-    def __init__(self, name, model, id=1):
+    def __init__(self, name, model, id=1, backend=None, switch_delay=0.1):
         cprint.info(f"Searching '{name}' device")
         self.name = name
         self.model = model
         self.id = id
+        # board factory: pymata4.Pymata4 or a stand-in with the same api
+        self.backend = pymata4.Pymata4 if backend is None else backend
+        # delay (in seconds) between writes to different ports
+        self.switch_delay = switch_delay
         self.ON = 2
         self.OFF = 1
         self.valves_pins = []
         self.sensors_pins = []
+        # shadow copy of the last value written to each pin
+        self.pin_state = {}
+        # total time (in seconds) spent switching pins on/off
+        self.switching_time = 0.0
         self.connection_attempt()
 
     def connect(self):
-        '''instantiate pymata4'''
+        '''instantiate pymata4 (or the configured board backend)'''
         wait = 3  # seconds
-        ser = pymata4.Pymata4(arduino_instance_id=self.id,
-                              arduino_wait=wait)
+        ser = self.backend(arduino_instance_id=self.id,
+                           arduino_wait=wait)
         cprint.success(f"Device '{self.name}' connected successfully")
 
         return ser
@@ -89,7 +103,7 @@ class ArduinoConnection:
             except Exception as _:
                 cprint.warn(
                     f"Device '{self.name}' not found or serial port in use!")
-                time.sleep(1)  # wait before next connection attempt
+                clocks.sleep(1)  # wait before next connection attempt
         else:
             cprint.fail(
                 f"Unable to connect to device named '{self.name}'. Exiting...")
@@ -98,14 +112,35 @@ class ArduinoConnection:
 
     def switch_all_off(self):
         '''switch all pins off'''
-        for pins in self.valves_pins:
-            for pin in pins:
-                self.ser.digital_write(pin, self.OFF)
-                time.sleep(0.1)
-        for pins in self.sensors_pins:
-            for pin in pins:
-                self.ser.digital_write(pin, self.OFF)
-                time.sleep(0.1)
+        values = {pin: self.OFF
+                  for pins in self.valves_pins + self.sensors_pins
+                  for pin in pins}
+        self._write_pins(values)
+
+    def _write_pins(self, values: dict, force: bool = False) -> None:
+        '''write only the pins whose value differs from the shadow state.
+           Changed pins are written port by port (8 pins per Firmata port)
+           waiting switch_delay between ports. Use force to write all pins
+           regardless of the shadow state (e.g. unknown board state)'''
+        for delay in self._write_steps(values, force):
+            clocks.sleep(delay)
+
+    def _write_steps(self, values: dict, force: bool = False):
+        '''generator version of _write_pins: writes one port at a time and
+           yields the delay required before writing the next one'''
+        ports = {}
+        for pin, value in values.items():
+            if force or self.pin_state.get(pin) != value:
+                ports.setdefault(pin // 8, []).append(pin)
+
+        for idx, port in enumerate(sorted(ports)):
+            if idx > 0:
+                yield self.switch_delay
+            for pin in ports[port]:
+                if values[pin] == self.ON:
+                    cprint.info(f"Turning ON pin {pin}")
+                self.ser.digital_write(pin, values[pin])
+                self.pin_state[pin] = values[pin]
 
     def _analog_to_digital(self, num) -> int:
         '''When configuring an analog input pin as a digital input/output,
@@ -157,12 +192,14 @@ class ArduinoConnection:
             proper_pins.append(self._convert_pin_number(pin))
 
         # set all pins as digital output
+        values = {}
         for pins in proper_pins:
             for pin in pins:
                 self.ser.set_pin_mode_digital_output(pin)
-                # turn off all pins at initialization
-                self.ser.digital_write(pin, self.OFF)
-                time.sleep(0.1)  # lets be cautious and wait a little bit
+                values[pin] = self.OFF
+
+        # turn off all pins at initialization (board state is unknown)
+        self._write_pins(values, force=True)
 
         return proper_pins
 
@@ -181,29 +218,37 @@ class ArduinoConnection:
 
     def switch_onoff(self, pins_lst: list, pins_pos: list, wait: float = 0.0) -> None:
         '''turn on selected pins at pins_pos and turn off all others'''
+        for delay in self.switch_steps(pins_lst, pins_pos):
+            clocks.sleep(delay)
+        # global wait (if requested)
+        clocks.sleep(wait)
+
+    def switch_steps(self, pins_lst: list, pins_pos: list):
+        '''generator version of switch_onoff, yields the delays between
+           port writes so the caller can overlap them (see PipelinedScheduler)'''
         # check if pins_pos is a list
         if not isinstance(pins_pos, list):
             raise TypeError
+        start = clocks.monotonic()
         # turn on select positions and turn off all others
+        values = {}
         for idx, pins in enumerate(pins_lst):
-            time.sleep(0.1)
-            if idx in pins_pos:
-                for pin in pins:
-                    cprint.info(f"Turning ON pin {pin}")
-                    self.ser.digital_write(pin, self.ON)
-            else:
-                for pin in pins:
-                    #cprint.info(f"Turning OFF pin {pin}")
-                    self.ser.digital_write(pin, self.OFF)
-        # global wait (if requested)
-        time.sleep(wait)
-
-    def sensors_loop(self, lcr_meter, sensors_pos, sloop, nvloop, rtime):
-        '''loop through all the selected sensors'''
+            for pin in pins:
+                values[pin] = self.ON if idx in pins_pos else self.OFF
+        yield from self._write_steps(values)
+        self.switching_time += clocks.monotonic() - start
+
+    def sensors_loop(self, lcr_meter, sensors_pos, sloop, nvloop, rtime,
+                     settle=0.5, dwell=None, writer=None):
+        '''loop through all the selected sensors.
+           Each slot reads for rtime seconds, or less if an adaptive dwell
+           is given and its criteria are met first.
+           With a writer (see storage.py) the readings are streamed to disk
+           instead of being kept in memory'''
         global global_counter
 
-        # LCR meter primary and secondary parameters
-        params = {'primary': [], 'secondary': []}
+        # LCR meter primary and secondary parameters (plus time spent reading)
+        params = {'primary': [], 'secondary': [], 'dwell': []}
 
         # data structures to store the readings
         sensors_lst = [f'S{idx}' for idx in sensors_pos]
@@ -217,25 +262,249 @@ class ArduinoConnection:
                 # first thing is to turn on the sensor and wait for it to settle
                 self.switch_onoff(self.sensors_pins, [spos])
                 # wait for the sensor to settle before taking a reading
-                time.sleep(0.5)
+                clocks.sleep(settle)
                 percent = round(100.0*global_counter/(nsensors*sloop*nvloop))
                 cprint.normal(f'Measuring... {percent}% completed')
-                # now we empty the input buffer list
-                lcr_meter.transport.serial.flush()
-                lcr_meter.protocol.received_lines = []
-                # read duration
-                time.sleep(rtime)
-                lines = copy.deepcopy(lcr_meter.protocol.received_lines)
-                for line in lines:
-                    pri, sec = line.split(',')
-                    sensors_dict[f'S{spos}']['primary'].append(
-                        float(pri))
-                    sensors_dict[f'S{spos}']['secondary'].append(
-                        float(sec))
+                primary, secondary, used = read_window(lcr_meter, rtime, dwell)
+                store_readings(sensors_dict, f'S{spos}',
+                               primary, secondary, used, writer)
 
         return sensors_dict
 
 
+class Dwell:
+    '''adaptive acquisition: a slot ends as soon as the given number of
+       samples was collected or the last window readings are stable
+       (relative standard deviation of the primary parameter below rstd)'''
+
+    def __init__(self, samples=0, rstd=0.0, window=5, poll=0.1):
+        self.samples = samples
+        self.rstd = rstd
+        self.window = window
+        self.poll = poll
+
+    @classmethod
+    def from_config(cls, cfg):
+        '''adaptive dwell from config file, None if disabled'''
+        samples = int(cfg.get_setting("acquisition", "dwell_samples", fallback=0))
+        rstd = float(cfg.get_setting("acquisition", "dwell_rstd", fallback=0.0))
+        window = int(cfg.get_setting("acquisition", "dwell_window", fallback=5))
+        if samples <= 0 and rstd <= 0:
+            return None
+
+        return cls(samples=samples, rstd=rstd, window=window)
+
+    def done(self, values) -> bool:
+        '''check whether the readings (numpy array) collected so far are
+           enough, overloads (nan) neither count nor enter the rstd window'''
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if self.samples > 0 and len(values) >= self.samples:
+            return True
+        if self.rstd > 0 and len(values) >= max(self.window, 2):
+            last = values[-self.window:]
+            mean = last.mean()
+            if mean == 0:
+                return False
+            return last.std(ddof=1)/abs(mean) < self.rstd
+
+        return False
+
+    def read(self, buffer, start, rtime) -> int:
+        '''poll the sample buffer from sequence number start until done
+           or rtime elapsed, returns the sequence number where reading stopped'''
+        stop = start
+        began = clocks.monotonic()
+        while True:
+            remaining = rtime - (clocks.monotonic() - began)
+            if remaining <= 0:
+                break
+            clocks.sleep(min(self.poll, remaining))
+            stop = buffer.seq
+            _, primary, _ = buffer.window(start, stop)
+            if self.done(primary):
+                break
+
+        return stop
+
+
+class PipelinedScheduler:
+    '''Overlaps valve and sensor actuation when valves and sensors are
+       driven by separate arduinos:
+
+           - the valve switch and the first sensor switch happen together
+           - the valve settle time runs along with the sensor settle time
+           - the next valve is staged during the tail of the last read
+             window of the previous sensor sweep (valve_settle seconds)
+
+       Interlocks name the pairs that must never overlap:
+
+           valves:sensors  valve switching and sensor switching
+           valves:settle   valve settle time and sensor settle time
+           valves:read     valve switching and a sensor read window
+    '''
+    INTERLOCKS = ('valves:sensors', 'valves:settle', 'valves:read')
+
+    def __init__(self, interlocks=('valves:read',)):
+        unknown = set(interlocks) - set(self.INTERLOCKS)
+        if unknown:
+            raise ValueError(f"Unknown interlocks: {', '.join(unknown)}")
+        self.interlocks = set(interlocks)
+        # seconds saved (compared to a sequential run) per valve cycle
+        self.saved = []
+        self._nominal = 0.0
+
+    @classmethod
+    def from_config(cls, cfg):
+        '''scheduler from config file, None if pipelining is disabled'''
+        if int(cfg.get_setting("acquisition", "pipeline", fallback=0)) != 1:
+            return None
+        interlocks = str(cfg.get_setting(
+            "acquisition", "interlocks", fallback="valves:read")).split(',')
+
+        return cls([val.strip() for val in interlocks if len(val.strip()) > 0])
+
+    def _run(self, *steps):
+        '''advance switching generators together, sleeping only the
+           longest of the concurrent delays'''
+        active = list(steps)
+        while active:
+            delays = []
+            for gen in list(active):
+                try:
+                    delays.append(next(gen))
+                except StopIteration:
+                    active.remove(gen)
+            if delays:
+                self._nominal += sum(delays)
+                clocks.sleep(max(delays))
+
+    def run(self, lcr_meter, arduino_valves, arduino_sensors, vloop, sloop,
+            stime, settle=0.5, dwell=None, valve_settle=0.0,
+            writer=None) -> list:
+        '''run the experiment main loop, same data layout as run_experiment'''
+        global global_counter
+
+        valves_pins = arduino_valves.valves_pins
+        sensors_pins = arduino_sensors.sensors_pins
+        valves_pos = range(len(valves_pins))
+        sensors_pos = range(len(sensors_pins))
+        nslots = vloop*len(valves_pos)*sloop*len(sensors_pos)
+        steps = [(cycle, vpos)
+                 for cycle in range(vloop) for vpos in valves_pos]
+        slots = [spos for _ in range(sloop) for spos in sensors_pos]
+
+        data = []
+        staged = False  # next valve already switched during a read window
+        valve_ready = 0.0  # when the current valve finishes settling
+        for idx, (cycle, vpos) in enumerate(steps):
+            if vpos == valves_pos[0]:
+                valves_dict = {f'V{pos}': {} for pos in valves_pos}
+                cycle_start = clocks.monotonic()
+                self._nominal = 0.0
+
+            # switch the valve and (if allowed) the first sensor together
+            sensor_switched = False
+            if not staged:
+                valve_steps = arduino_valves.switch_steps(valves_pins, [vpos])
+                if 'valves:sensors' in self.interlocks:
+                    self._run(valve_steps)
+                else:
+                    self._run(valve_steps,
+                              arduino_sensors.switch_steps(sensors_pins, [slots[0]]))
+                    sensor_switched = True
+                valve_ready = clocks.monotonic() + valve_settle
+            staged = False
+            self._nominal += valve_settle
+            if writer is not None:
+                writer.start_valve(cycle, f'V{vpos}')
+
+            sensors_dict = {f'S{pos}': {'primary': [], 'secondary': [], 'dwell': []}
+                            for pos in sensors_pos}
+            for num, spos in enumerate(slots):
+                global_counter += 1
+                if not sensor_switched:
+                    self._run(arduino_sensors.switch_steps(sensors_pins, [spos]))
+                sensor_switched = False
+                # wait for the sensor (and the valve) to settle
+                if 'valves:settle' in self.interlocks:
+                    settled = max(clocks.monotonic(), valve_ready) + settle
+                else:
+                    settled = max(clocks.monotonic() + settle, valve_ready)
+                self._nominal += settle
+                clocks.sleep(settled - clocks.monotonic())
+                percent = round(100.0*global_counter/nslots)
+                cprint.normal(f'Measuring... {percent}% completed')
+
+                # stage the next valve during the tail of the last read window
+                last = num == len(slots) - 1 and idx + 1 < len(steps)
+                lead = min(valve_settle, stime)
+                if last and lead > 0 and dwell is None and \
+                        'valves:read' not in self.interlocks:
+                    seq = clear_input(lcr_meter)
+                    start = clocks.monotonic()
+                    clocks.sleep(stime - lead)
+                    self._run(arduino_valves.switch_steps(
+                        valves_pins, [steps[idx + 1][1]]))
+                    valve_ready = clocks.monotonic() + valve_settle
+                    clocks.sleep(start + stime - clocks.monotonic())
+                    _, primary, secondary = lcr_meter.protocol.samples.window(seq)
+                    used = clocks.monotonic() - start
+                    staged = True
+                else:
+                    primary, secondary, used = read_window(
+                        lcr_meter, stime, dwell)
+                self._nominal += used
+                store_readings(sensors_dict, f'S{spos}',
+                               primary, secondary, used, writer)
+
+            valves_dict[f'V{vpos}'] = sensors_dict
+            if vpos == valves_pos[-1]:
+                data.append(valves_dict)
+                saved = self._nominal - (clocks.monotonic() - cycle_start)
+                self.saved.append(saved)
+                cprint.info(
+                    f'Pipelining saved {saved:.2f}s in cycle {cycle + 1}')
+
+        return data
+
+
+def clear_input(lcr_meter) -> int:
+    '''start of a read window: flush the serial port and return the
+       sequence number of the next sample to be received'''
+    lcr_meter.transport.serial.flush()
+    return lcr_meter.protocol.samples.seq
+
+
+def read_window(lcr_meter, rtime, dwell=None):
+    '''read samples for rtime seconds, or less with an adaptive dwell.
+       Returns primary and secondary arrays and the time spent reading'''
+    buffer = lcr_meter.protocol.samples
+    start = clear_input(lcr_meter)
+    began = clocks.monotonic()
+    if dwell is None:
+        clocks.sleep(rtime)
+        stop = buffer.seq
+    else:
+        stop = dwell.read(buffer, start, rtime)
+    _, primary, secondary = buffer.window(start, stop)
+
+    return primary, secondary, clocks.monotonic() - began
+
+
+def store_readings(sensors_dict, sensor_key, primary, secondary, used,
+                   writer=None):
+    '''append a read window samples to the sensor readings
+       (or to the readings file if a writer is given)'''
+    if writer is not None:
+        writer.write(sensor_key, primary, secondary, used)
+        return
+    sensor = sensors_dict[sensor_key]
+    sensor['dwell'].append(used)
+    sensor['primary'].extend(primary.tolist())
+    sensor['secondary'].extend(secondary.tolist())
+
+
 class SerialConnection:
     '''threaded serial port connection'''
 
@@ -254,11 +523,13 @@ class SerialConnection:
         # serial connection parameters
         self.port = str(cfg.get_setting("serial", "port"))
         self.url = str(cfg.get_setting("serial", "port"))
-        self.baudrate = int(cfg.get_setting("serial", "baudrate"))
+        self.baudrate = cfg.get_int("serial", "baudrate")
         self.parity = str(cfg.get_setting("serial", "parity"))
-        self.stopbits = int(cfg.get_setting("serial", "stopbits"))
-        self.bytesize = int(cfg.get_setting("serial", "bytesize"))
-        self.timeout = int(cfg.get_setting("serial", "timeout"))
+        self.stopbits = cfg.get_int("serial", "stopbits")
+        self.bytesize = cfg.get_int("serial", "bytesize")
+        self.timeout = cfg.get_int("serial", "timeout")
+        # number of readings kept in memory by the reader thread
+        self.buffer_size = cfg.get_int("serial", "buffer_size", fallback=65536)
         self.ser_parameters = {'url': self.url,
                                'baudrate': self.baudrate,
                                'stopbits': self.stopbits,
@@ -275,7 +546,8 @@ class SerialConnection:
             **self.ser_parameters, do_not_open=False)
 
         # start the serial monitoring thread
-        self.thread = ReaderThread(self.ser, SerialReaderProtocolLine)
+        self.thread = ReaderThread(self.ser, functools.partial(
+            SerialReaderProtocolLine, self.buffer_size))
         self.thread.start()
         self.transport, self.protocol = self.thread.connect()
 
@@ -284,13 +556,14 @@ class SerialConnection:
             cprint.warn(
                 f"Waiting serial port ({self.name}) to became ready...")
             if isinstance(wait, int) and wait > 0:
-                time.sleep(wait)
+                clocks.sleep(wait)
             elif isinstance(wait, str):
                 # 30s wait timeout
-                t_end = time.time() + 30
-                while time.time() < t_end:
+                t_end = clocks.time() + 30
+                while clocks.time() < t_end:
                     if str(wait.lower()) in self.protocol.received_lines:
                         break
+                    clocks.sleep(0.1)
                 else:
                     cprint.fail(
                         f"***ERROR: Serial port ({self.name}) not ready, timed out!")
@@ -306,15 +579,15 @@ class SerialConnection:
             try:
                 self.connect()
                 # set LCR trigger to manual/software controlled mode
-                time.sleep(0.2)
+                clocks.sleep(0.2)
                 self.protocol.write_line('APER SLOW')
-                time.sleep(0.2)
+                clocks.sleep(0.2)
                 self.protocol.write_line('TRIG:SOUR INT')
                 break
             except Exception as _:
                 cprint.warn(
                     f"Device '{self.name}' not found or serial port in use!")
-                time.sleep(1)  # wait before next connection attempt
+                clocks.sleep(1)  # wait before next connection attempt
         else:
             cprint.fail(
                 f"Unable to connect to device named '{self.name}'. Exiting...")
@@ -327,62 +600,215 @@ class SerialConnection:
         self.ser.close()
 
 
+# values the lcr meter reports when a reading is out of range
+OVERLOAD_TOKENS = (b'OVLD', b'OVER', b'OVERLOAD', b'+OVLD', b'-OVLD', b'----')
+OVERLOAD_LIMIT = 9.9e37
+
+
+def _to_float(fields):
+    '''convert an array of byte strings to float, returns values and
+       a mask of the ones that are not numbers (set to nan)'''
+    try:
+        return fields.astype(float), np.zeros(len(fields), dtype=bool)
+    except ValueError:
+        pass
+    # slow path, only taken when the chunk contains garbage
+    values = np.full(len(fields), np.nan)
+    bad = np.zeros(len(fields), dtype=bool)
+    for idx, field in enumerate(fields):
+        try:
+            values[idx] = float(field)
+        except ValueError:
+            bad[idx] = True
+    return values, bad
+
+
+def parse_readings(lines):
+    '''vectorized parsing of 'primary,secondary' lcr meter lines.
+       Accepts raw bytes (several lines) or a list of lines (bytes or str).
+       Returns primary and secondary arrays of the valid lines plus the
+       number of malformed lines (partial lines, echoes, error messages).
+       Overloaded readings are kept as nan'''
+    if isinstance(lines, (bytes, bytearray)):
+        lines = bytes(lines).splitlines()
+    lines = [line.encode('utf-8', 'replace') if isinstance(line, str) else line
+             for line in lines]
+    raw = np.char.strip(np.array(lines, dtype=bytes))
+    raw = raw[np.char.str_len(raw) > 0]
+    if len(raw) == 0:
+        return np.empty(0), np.empty(0), 0
+
+    # exactly one separator per line
+    fields = np.char.partition(raw, b',')
+    pri = np.char.strip(fields[:, 0])
+    sec = np.char.strip(fields[:, 2])
+    valid = (fields[:, 1] == b',') & (np.char.find(sec, b',') < 0)
+
+    # keep malformed lines and overload formats out of the conversion
+    for field in (pri, sec):
+        field[~valid | np.isin(np.char.upper(field), OVERLOAD_TOKENS)] = b'nan'
+
+    primary, bad_pri = _to_float(pri)
+    secondary, bad_sec = _to_float(sec)
+    valid &= ~(bad_pri | bad_sec)
+    primary[np.abs(primary) >= OVERLOAD_LIMIT] = np.nan
+    secondary[np.abs(secondary) >= OVERLOAD_LIMIT] = np.nan
+
+    return primary[valid], secondary[valid], int(len(raw) - valid.sum())
+
+
+class SampleBuffer:
+    '''Preallocated, thread-safe ring buffer of parsed LCR readings.
+       Every sample gets a sequence number (its position in the stream),
+       consumers read a window by sequence number without copying
+       the whole buffer. Old samples are overwritten when full.'''
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity)
+        self.primary = np.zeros(capacity)
+        self.secondary = np.zeros(capacity)
+        # sequence number of the next sample
+        self.seq = 0
+        # lines that could not be parsed
+        self.invalid = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, primary, secondary):
+        with self._lock:
+            idx = self.seq % self.capacity
+            self.timestamps[idx] = timestamp
+            self.primary[idx] = primary
+            self.secondary[idx] = secondary
+            self.seq += 1
+
+    def extend(self, timestamp, primary, secondary):
+        '''append a batch of samples received at the same time'''
+        count = len(primary)
+        if count == 0:
+            return
+        with self._lock:
+            # only the newest samples fit in the buffer
+            skip = max(count - self.capacity, 0)
+            idx = np.arange(self.seq + skip, self.seq + count) % self.capacity
+            self.timestamps[idx] = timestamp
+            self.primary[idx] = primary[skip:]
+            self.secondary[idx] = secondary[skip:]
+            self.seq += count
+
+    def window(self, start, stop=None):
+        '''copy of the samples from sequence number start up to stop
+           (default: latest). Returns timestamps, primary and secondary
+           arrays, samples already overwritten are skipped'''
+        with self._lock:
+            stop = self.seq if stop is None else min(stop, self.seq)
+            start = max(start, stop - self.capacity, 0)
+            idx = np.arange(start, stop) % self.capacity
+            return (self.timestamps[idx], self.primary[idx],
+                    self.secondary[idx])
+
+
 class SerialReaderProtocolLine(LineReader):
     '''read lines of data'''
     TERMINATOR = b'\n'
     ENCODING = 'utf-8'
 
-    def __init__(self):
+    def __init__(self, capacity=65536):
         super(SerialReaderProtocolLine, self).__init__()
-        self.received_lines = []
+        # parsed readings
+        self.samples = SampleBuffer(capacity)
+        # last raw lines received (e.g. for device ready messages)
+        self.received_lines = collections.deque(maxlen=100)
 
     def connection_made(self, transport):
         """Called when reader thread is started"""
         super(SerialReaderProtocolLine, self).connection_made(transport)
         self.transport.serial.reset_input_buffer()
 
+    def data_received(self, data):
+        """Parse all complete lines of a chunk in a single batch"""
+        self.buffer.extend(data)
+        if self.TERMINATOR not in data:
+            return
+        lines, _, rest = bytes(self.buffer).rpartition(self.TERMINATOR)
+        self.buffer = bytearray(rest)
+        self.handle_lines(lines.split(self.TERMINATOR))
+
+    def handle_lines(self, lines):
+        """New lines waiting to be processed"""
+        primary, secondary, invalid = parse_readings(lines)
+        self.samples.extend(clocks.monotonic(), primary, secondary)
+        # partial lines, echoes or error messages
+        self.samples.invalid += invalid
+        self.received_lines.extend(
+            line.decode(self.ENCODING, self.UNICODE_HANDLING)
+            for line in lines[-self.received_lines.maxlen:])
+
     def handle_line(self, line):
         """New line waiting to be processed"""
-        # line = str(int(round(time.time() * 1000))) + ',' + line # add timestamp
-        self.received_lines.append(line)
+        self.handle_lines([line.encode(self.ENCODING, self.UNICODE_HANDLING)])
 
     def connection_lost(self, exc):
         if exc:
-            traceback.print_exc(exc)
+            traceback.print_exception(exc)
         cprint.warn('Serial port closed')
 
 
 def shutdown(lcr_meter, arduinos):
-    '''ends serial connections, closes active threads and turn off all valves and sensors'''
+    '''ends serial connections, closes active threads and turn off all valves and sensors
+       (lcr_meter is None if it never connected)'''
     try:
-        # return lcr meter to manual trigger mode (stops auto measurement)
-        lcr_meter.protocol.write_line('TRIG:SOUR MAN')
-        time.sleep(0.1)
-        lcr_meter.close()
+        if lcr_meter is not None:
+            # return lcr meter to manual trigger mode (stops auto measurement)
+            lcr_meter.protocol.write_line('TRIG:SOUR MAN')
+            clocks.sleep(0.1)
+            lcr_meter.close()
         for arduino in arduinos.values():
             # turn off all pin energy
             arduino.switch_all_off()
-            time.sleep(0.1)
+            clocks.sleep(0.1)
             arduino.ser.shutdown()
             cprint.warn(f'Arduino {arduino.name} shutdown')
-        now = datetime.now().strftime("%Y-%m-%d %H:%M")
-        cprint.bold(f'..:: Experiment ended at {now} ::..')
     except Exception as exc:
         #print(traceback.format_exc())
         pass
 
 
-def run_experiment(lcr_meter, arduinos, vloop, sloop, stime):
-    '''run the experiment'''
+def switch_off(arduinos):
+    '''turn off all valves and sensors, the connections stay open
+       (devices reused by the next experiment)'''
+    for arduino in arduinos.values():
+        arduino.switch_all_off()
+
+
+def run_experiment(lcr_meter, arduinos, vloop, sloop, stime,
+                   settle=0.5, dwell=None, valve_settle=0.0, scheduler=None,
+                   writer=None, warmup=1):
+    '''run the experiment (see sensors_loop for settle and dwell).
+       A PipelinedScheduler is used if given and valves and sensors are
+       driven by separate arduinos.
+       If a writer is given the readings are only stored in its file,
+       use storage.load_results() to read them back.
+       warmup seconds are waited first (devices just connected)'''
     global global_counter
     global_counter = 0
 
     # wait before starting a measurement
-    time.sleep(1)
+    clocks.sleep(warmup)
 
-    now = datetime.now().strftime("%Y-%m-%d %H:%M")
+    now = clocks.now().strftime("%Y-%m-%d %H:%M")
     cprint.bold(f'..:: Experiment started at {now}  ::..')
+    try:
+        return _experiment_loops(lcr_meter, arduinos, vloop, sloop, stime,
+                                 settle, dwell, valve_settle, scheduler, writer)
+    finally:
+        now = clocks.now().strftime("%Y-%m-%d %H:%M")
+        cprint.bold(f'..:: Experiment ended at {now} ::..')
+
 
+def _experiment_loops(lcr_meter, arduinos, vloop, sloop, stime, settle,
+                      dwell, valve_settle, scheduler, writer):
+    '''valves and sensors loops of run_experiment'''
     # find out number of arduinos configured
     if len(arduinos) == 1:
         arduino_sensors = arduinos['all']
@@ -403,31 +829,46 @@ def run_experiment(lcr_meter, arduinos, vloop, sloop, stime):
         cprint.fail('Please configure arduino pins first!')
         sys.exit(1)
 
+    # overlap valves and sensors actuation (separate boards only)
+    if scheduler is not None and arduino_sensors is not arduino_valves:
+        return scheduler.run(lcr_meter, arduino_valves, arduino_sensors,
+                             vloop, sloop, stime, settle, dwell, valve_settle,
+                             writer)
+
     # store retrieved data in a list of dictionaries
     data = []
     valves_lst = [f'V{idx}' for idx in valves_pos]
 
     # main experiment loop
     nvloop = vloop*len(valves_pos)
-    for _ in range(vloop):
+    for cycle in range(vloop):
         valves_dict = {key: copy.deepcopy({})
                        for key in copy.deepcopy(valves_lst)}
         for vpos in valves_pos:
-            arduino_valves.switch_onoff(arduino_valves.valves_pins, [vpos])
+            arduino_valves.switch_onoff(arduino_valves.valves_pins, [vpos],
+                                        wait=valve_settle)
+            if writer is not None:
+                writer.start_valve(cycle, f'V{vpos}')
             valves_dict[f'V{vpos}'] = arduino_sensors.sensors_loop(lcr_meter,
                                                                    sensors_pos,
                                                                    sloop,
                                                                    nvloop,
-                                                                   stime)
+                                                                   stime,
+                                                                   settle,
+                                                                   dwell,
+                                                                   writer)
         # append to list only after a valve cycle is completed
         data.append(valves_dict)
 
     return data
 
 
-def arduinos_connect(cfg) -> Dict[str, ArduinoConnection]:
-    '''connect to arduinos'''
+def arduinos_connect(cfg, backend=None) -> Dict[str, ArduinoConnection]:
+    '''connect to arduinos using the given board backend (default: pymata4)'''
     boards = {}
+    # delay between port writes, zero for boards that do not need it
+    switch_delay = float(cfg.get_setting(
+        "acquisition", "switch_delay", fallback=0.1))
     # check if arduino2 is present/configured
     device = "arduino2"
     device_model = str(cfg.get_setting(device, "model"))
@@ -448,7 +889,8 @@ def arduinos_connect(cfg) -> Dict[str, ArduinoConnection]:
         sensors = [val.split(',') for val in device_sensors if len(val) > 0]
         valves = [val.split(',') for val in device_valves if len(val) > 0]
         boards['all'] = ArduinoConnection(
-            'valves & sensors', device_board, id=1)
+            'valves & sensors', device_board, id=1, backend=backend,
+            switch_delay=switch_delay)
         boards['all'].configure_pins(
             valves_pins=valves, sensors_pins=sensors)
         # check for inverted ON/OFF logic in arduino config
@@ -458,13 +900,15 @@ def arduinos_connect(cfg) -> Dict[str, ArduinoConnection]:
     else:  # two arduinos
         if empty_sensors:  # find out which arduino is the sensors one
             boards['valves'] = ArduinoConnection(
-                'valves', device_board, id=2)
+                'valves', device_board, id=2, backend=backend,
+                switch_delay=switch_delay)
             # get other arduino configuration
             other_device = "arduino1"
             other_device_model = str(cfg.get_setting(other_device, "model"))
             other_device_board = Board.MEGA if other_device_model == 'MEGA' else Board.UNO
             boards['sensors'] = ArduinoConnection(
-                'sensors', other_device_board, id=1)
+                'sensors', other_device_board, id=1, backend=backend,
+                switch_delay=switch_delay)
             device_sensors = str(cfg.get_setting(
                 other_device, "sensors")).split(';')
             device_valves = str(cfg.get_setting(
@@ -482,13 +926,15 @@ def arduinos_connect(cfg) -> Dict[str, ArduinoConnection]:
                 boards['sensors'].invert_onoff()
         elif empty_valves:
             boards['sensors'] = ArduinoConnection(
-                'sensors', device_board, id=2)
+                'sensors', device_board, id=2, backend=backend,
+                switch_delay=switch_delay)
             # get other arduino configuration
             other_device = 'arduino1'
             other_device_model = str(cfg.get_setting(other_device, "model"))
             other_device_board = Board.MEGA if other_device_model == 'MEGA' else Board.UNO
             boards['valves'] = ArduinoConnection(
-                'valves', other_device_board, id=1)
+                'valves', other_device_board, id=1, backend=backend,
+                switch_delay=switch_delay)
             device_valves = str(cfg.get_setting(
                 other_device, "valves")).split(';')
             device_sensors = str(cfg.get_setting(
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 by bgeneto <b g e n e t o @ g m a i l . c o m>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__doc__ = """
+Export experiment results to csv files and plots.
+
+The experiment columnar store (see storage.py) is turned into a single
+tidy table, one row per sample, sorted by valve, sensor and acquisition
+order. Every csv file is a slice of that table:
+
+    export_results(output_dir)
+
+Plots are not written to disk but rendered on request by the web server,
+in a pool of worker processes, and kept in a cache:
+
+    renderer = PlotRenderer(workers=2)
+    html, secs = renderer.render(output_dir, 'primary', 'V1-S1').result()
+
+Classes:
+
+    PlotRenderer
+    PlotCache
+
+Functions:
+
+    tidy_table(results, slots=None)
+    each_sensor(table, params=PARAMS)
+    all_sensors(table, params=PARAMS)
+    write_each_sensor(table, output_dir)
+    write_all_sensors(table, output_dir)
+    minmax_downsample(x, y, points)
+    lttb_downsample(x, y, points)
+    downsample(frame, points=2000, method='lttb', x0=None, x1=None)
+    render_plot(frame, points=2000, method='lttb')
+    plot_frame(output_dir, param, name)
+    plot_html(output_dir, param, name, points=2000, method='lttb')
+    plot_data(output_dir, param, name, x0=None, x1=None, points=2000, method='lttb')
+    data_slice(output_dir, valve, sensor, param='primary', cycles=None, loops=None,
+               step=1, points=0, fmt='json', max_samples=1000000, info=None)
+    export_results(output_dir)
+    install_plotlyjs(js_dir)
+    update_output_dir(base_dir)
+
+Misc variables:
+
+    __version__
+    __author__
+"""
+
+import collections
+import functools
+import gzip
+import json
+import math
+import os
+import threading
+import time
+from concurrent import futures
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io
+import plotly.offline
+
+import indexer
+import storage
+from colorprint import ColorPrint
+
+__author__ = "bgeneto"
+__copyright__ = "Copyright 2022, bgeneto"
+__credits__ = ["bgeneto"]
+__license__ = "GPL"
+__maintainer__ = "Bernhard Enders"
+__email__ = "b g e n e t o @ d u c k . c o m"
+__version__ = "1.0.0"
+__modified__ = "20261016"
+
+
+def update_output_dir(base_dir):
+    """Update the output directory generating correspoding 'index.html' files"""
+    parser = indexer.add_args()
+    args = parser.parse_args([base_dir, '--recursive', '--incremental'])
+    indexer.process_dir(args.top_dir, args)
+
+
+PARAMS = ('primary', 'secondary')
+
+
+def tidy_table(results, slots=None):
+    '''long format table of a storage.ColumnarResults, one row per sample:
+       valve, sensor, cycle and loop numbers plus primary and secondary
+       values. Rows are sorted by valve, sensor and acquisition order, the
+       valve and sensor names are kept in table.attrs. Only the samples of
+       the given slots (see ColumnarResults.select) are read, if any'''
+    if slots is None:
+        slots = results.slots
+        columns = results.columns
+    else:
+        columns = {param: results.concat(slots, param) for param in PARAMS}
+    slot_id = np.repeat(np.arange(len(slots)), slots['count'])
+    valve = slots['valve'][slot_id]
+    sensor = slots['sensor'][slot_id]
+    # samples are stored in acquisition order, a stable sort keeps it
+    order = np.lexsort((sensor, valve))
+    slot_id = slot_id[order]
+    table = pd.DataFrame({'valve': valve[order],
+                          'sensor': sensor[order],
+                          'cycle': slots['cycle'][slot_id],
+                          'loop': slots['loop'][slot_id],
+                          'primary': columns['primary'][order],
+                          'secondary': columns['secondary'][order]})
+    table.attrs['valves'] = list(results.valves)
+    table.attrs['sensors'] = list(results.sensors)
+
+    return table
+
+
+def _groups(keys):
+    '''(key, start, stop) of the runs of equal values in a sorted array'''
+    uniq, starts = np.unique(keys, return_index=True)
+    stops = np.append(starts[1:], len(keys))
+    return zip(uniq, starts, stops)
+
+
+def _label(table, valve, sensor=None):
+    '''V1, V1.S1, ... from the zero based names (V0, S0, ...)'''
+    vnum = int(table.attrs['valves'][valve][1:]) + 1
+    if sensor is None:
+        return f'V{vnum}'
+    snum = int(table.attrs['sensors'][sensor][1:]) + 1
+    return f'V{vnum}.S{snum}'
+
+
+def each_sensor(table, params=PARAMS):
+    '''yield (param, label, series) of every valve and sensor'''
+    nsensors = len(table.attrs['sensors'])
+    keys = table['valve'].to_numpy()*nsensors + table['sensor'].to_numpy()
+    for key, start, stop in _groups(keys):
+        valve, sensor = divmod(int(key), nsensors)
+        label = _label(table, valve, sensor)
+        for param in params:
+            yield param, label, pd.Series(table[param].to_numpy()[start:stop],
+                                          name=label)
+
+
+def all_sensors(table, params=PARAMS):
+    '''yield (param, label, dataframe) of every valve with all its sensors
+       side by side. Every valve cycle contributes the same number of rows
+       per sensor: the smallest number of samples of any of its sensors'''
+    valves = table['valve'].to_numpy()
+    for valve, vstart, vstop in _groups(valves):
+        sensors = table['sensor'].to_numpy()[vstart:vstop]
+        cycles = table['cycle'].to_numpy()[vstart:vstop]
+        # first row and number of rows of every (sensor, cycle) pair
+        columns = {}
+        for sensor, start, stop in _groups(sensors):
+            cycle, first, count = np.unique(cycles[start:stop],
+                                            return_index=True,
+                                            return_counts=True)
+            columns[sensor] = dict(zip(cycle, zip(vstart + start + first, count)))
+        # only cycles that every sensor completed (e.g. after a crash)
+        common = sorted(set.intersection(*(set(col) for col in columns.values())))
+        if not common:
+            continue
+        min_rows = min(columns[sensor][cycle][1]
+                       for sensor in columns for cycle in common)
+        # table rows of each sensor column: the first min_rows of every cycle
+        rows = {}
+        for sensor, column in columns.items():
+            firsts = np.array([column[cycle][0] for cycle in common])
+            rows[sensor] = (firsts[:, None] + np.arange(min_rows)).ravel()
+        for param in params:
+            values = table[param].to_numpy()
+            yield param, _label(table, valve), pd.DataFrame(
+                {_label(table, valve, sensor): values[idx]
+                 for sensor, idx in rows.items()})
+
+
+def _file_name(label):
+    '''V1.S1 -> V1-S1'''
+    return label.replace('.', '-')
+
+
+def write_each_sensor(table, output_dir):
+    '''one csv file per valve, sensor and parameter'''
+    for param, label, pseries in each_sensor(table):
+        pseries.to_csv(os.path.join(output_dir, param, _file_name(label))+'.csv')
+
+
+def write_all_sensors(table, output_dir):
+    '''one csv file per valve and parameter with all its sensors'''
+    for param, label, valve_df in all_sensors(table):
+        valve_df.to_csv(os.path.join(output_dir, param, _file_name(label))+'.csv')
+
+
+def minmax_downsample(x, y, points):
+    '''keep the smallest and largest value of points/2 equal buckets,
+       spikes survive the downsampling'''
+    if len(y) <= points:
+        return x, y
+    buckets = max(points // 2, 1)
+    size = -(-len(y) // buckets)
+    pad = buckets*size - len(y)
+    low = np.append(y, np.full(pad, np.inf)).reshape(buckets, size)
+    high = np.append(y, np.full(pad, -np.inf)).reshape(buckets, size)
+    offsets = np.arange(buckets)*size
+    idx = np.unique(np.concatenate((offsets + low.argmin(axis=1),
+                                    offsets + high.argmax(axis=1))))
+
+    return x[idx], y[idx]
+
+
+def lttb_downsample(x, y, points):
+    '''largest triangle three buckets: keeps the first and last point and,
+       from each of points-2 buckets, the point that makes the largest
+       triangle with the previous kept point and the next bucket average'''
+    if len(y) <= points or points < 3:
+        return x, y
+    edges = np.linspace(1, len(y) - 1, points - 1).astype(int)
+    idx = np.zeros(points, dtype=int)
+    kept = 0
+    for bucket in range(points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        nstop = edges[bucket + 2] if bucket + 2 < len(edges) else len(y)
+        avg_x = x[stop:nstop].mean()
+        avg_y = y[stop:nstop].mean()
+        area = np.abs((x[kept] - avg_x)*(y[start:stop] - y[kept]) -
+                      (x[kept] - x[start:stop])*(avg_y - y[kept]))
+        kept = start + int(area.argmax())
+        idx[bucket + 1] = kept
+    idx[-1] = len(y) - 1
+
+    return x[idx], y[idx]
+
+
+DOWNSAMPLE = {'lttb': lttb_downsample, 'minmax': minmax_downsample}
+
+
+def downsample(frame, points=2000, method='lttb', x0=None, x1=None):
+    '''{label: (x, y)} of every column of a series or dataframe, limited to
+       the [x0, x1] row range and to points per column (0 = all points).
+       Non finite values (overloads) are left out'''
+    if isinstance(frame, pd.Series):
+        frame = frame.to_frame()
+    start = 0 if x0 is None else max(int(np.floor(x0)), 0)
+    stop = len(frame) if x1 is None else max(int(np.ceil(x1)) + 1, start)
+    traces = {}
+    for col in frame.columns:
+        y = frame[col].to_numpy(dtype=float)[start:stop]
+        x = np.arange(start, start + len(y))
+        finite = np.isfinite(y)
+        x, y = x[finite], y[finite]
+        if points > 0:
+            x, y = DOWNSAMPLE[method](x, y, points)
+        traces[str(col)] = (x, y)
+
+    return traces
+
+
+# fetch the full resolution data of the zoomed range (see plot_data)
+ZOOM_SCRIPT = """
+var gd = document.getElementById('{plot_id}');
+var url = window.location.pathname.replace(/\\.html$/, '.json');
+gd.on('plotly_relayout', function (ev) {
+    var query = '';
+    if (ev['xaxis.range[0]'] !== undefined) {
+        query = '?x0=' + ev['xaxis.range[0]'] + '&x1=' + ev['xaxis.range[1]'];
+    } else if (!ev['xaxis.autorange']) {
+        return;
+    }
+    fetch(url + query).then(function (resp) { return resp.json(); })
+        .then(function (data) {
+            var update = {x: [], y: []};
+            gd.data.forEach(function (trace) {
+                update.x.push(data[trace.name].x);
+                update.y.push(data[trace.name].y);
+            });
+            Plotly.restyle(gd, update);
+        });
+});
+"""
+
+
+def render_plot(frame, points=2000, method='lttb', plotlyjs='cdn'):
+    '''html page with the (downsampled) plot of a series or dataframe,
+       drawn with webgl traces. plotlyjs is the url of plotly.js
+       (see install_plotlyjs) or cdn'''
+    fig = go.Figure()
+    for label, (x, y) in downsample(frame, points, method).items():
+        fig.add_trace(go.Scattergl(x=x, y=y, name=label, mode='lines+markers'))
+    fig.update_layout(xaxis_title='index', yaxis_title='value',
+                      legend_title_text='variable')
+
+    return plotly.io.to_html(fig, include_plotlyjs=plotlyjs,
+                             post_script=ZOOM_SCRIPT)
+
+
+def _stored_name(names, label):
+    '''V0, S0, ... of a one based label part (V1, S1, ...)'''
+    for stored in names:
+        if int(stored[1:]) + 1 == int(label[1:]):
+            return stored
+
+    raise KeyError(label)
+
+
+def plot_frame(output_dir, param, name):
+    '''series of a sensor (V1-S1) or dataframe of a valve (V1). Only the
+       samples of that valve or sensor are read, zooming a plot does not
+       cost the size of the whole experiment'''
+    results = storage.open_results(output_dir)
+    labels = name.split('-')
+    try:
+        valve = _stored_name(results.valves, labels[0])
+        sensor = _stored_name(results.sensors, labels[1]) if len(labels) > 1 else None
+    except (KeyError, ValueError, IndexError):
+        raise KeyError(f'{name} not found in {output_dir}')
+    table = tidy_table(results, results.select(valve, sensor))
+    frames = each_sensor if sensor is not None else all_sensors
+    for _, label, frame in frames(table, params=(param,)):
+        if _file_name(label) == name:
+            return frame
+
+    raise KeyError(f'{name} not found in {output_dir}')
+
+
+def plot_html(output_dir, param, name, points=2000, method='lttb',
+              plotlyjs='cdn'):
+    '''render the plot of a valve (V1) or sensor (V1-S1) of an experiment,
+       returns its html and the time spent (runs in a PlotRenderer worker)'''
+    start = time.perf_counter()
+    html = render_plot(plot_frame(output_dir, param, name), points, method,
+                       plotlyjs)
+
+    return html, time.perf_counter() - start
+
+
+def plot_data(output_dir, param, name, x0=None, x1=None, points=2000,
+              method='lttb'):
+    '''{label: {x, y}} of a plot for the [x0, x1] range, at full resolution
+       if the range has less than points samples'''
+    traces = downsample(plot_frame(output_dir, param, name),
+                        points, method, x0, x1)
+
+    return {label: {'x': x.tolist(), 'y': y.tolist()}
+            for label, (x, y) in traces.items()}
+
+
+def data_slice(output_dir, valve, sensor, param='primary', cycles=None,
+               loops=None, step=1, points=0, fmt='json', max_samples=1000000,
+               info=None):
+    '''samples of a sensor for the /data api, only the selected slots
+       (see ColumnarResults.select) are read. Returns the body (json with
+       info added, or the float64 little-endian samples for bin), the step
+       used and the samples per slot. ValueError if more than max_samples'''
+    results = storage.open_results(output_dir)
+    slots = results.select(valve, sensor, cycles=cycles, loops=loops)
+    if points > 0:
+        step = max(step, -(-int(slots['count'].sum()) // points))
+    counts = -(-slots['count'] // step)
+    if counts.sum() > max_samples:
+        raise ValueError(f'more than {max_samples} samples, use step or points')
+    values = results.concat(slots, param, step)
+
+    if fmt == 'bin':
+        return values.astype('<f8').tobytes(), step, counts.tolist()
+    # json has no nan (overloads and converted results without time)
+    data = dict(info or {})
+    data.update(step=step,
+                slots={'cycle': slots['cycle'].tolist(),
+                       'loop': slots['loop'].tolist(),
+                       'time': [val if math.isfinite(val) else None
+                                for val in slots['time'].tolist()],
+                       'count': counts.tolist()},
+                values=[val if math.isfinite(val) else None
+                        for val in values.tolist()])
+
+    return json.dumps(data).encode(), step, counts.tolist()
+
+
+class PlotRenderer:
+    '''Renders plots in a pool of worker processes, at most workers
+       plots at a time. The time spent on every figure is logged.
+       Plots are downsampled to points per trace (0 = all points)'''
+
+    def __init__(self, workers=2, log=None, points=2000, method='lttb',
+                 plotlyjs='cdn'):
+        if method not in DOWNSAMPLE:
+            raise ValueError(f'Unknown downsampling method: {method}')
+        self.workers = max(1, workers)
+        self.log = ColorPrint() if log is None else log
+        self.points = points
+        self.method = method
+        self.plotlyjs = plotlyjs
+        self._executor = futures.ProcessPoolExecutor(max_workers=self.workers)
+
+    @classmethod
+    def from_config(cls, cfg, log=None, plotlyjs='cdn'):
+        workers = int(cfg.get_setting("export", "plot_workers", fallback=2))
+        points = int(cfg.get_setting("export", "plot_points", fallback=2000))
+        method = str(cfg.get_setting("export", "plot_downsample", fallback="lttb"))
+
+        return cls(workers, log, points, method, plotlyjs)
+
+    @property
+    def settings(self):
+        '''what the rendered pages depend on besides the experiment data'''
+        return self.points, self.method, self.plotlyjs
+
+    def render(self, output_dir, param, name):
+        '''render a plot in background (see plot_html), returns a future'''
+        future = self._executor.submit(plot_html, output_dir, param, name,
+                                       self.points, self.method, self.plotlyjs)
+        future.add_done_callback(functools.partial(
+            self._finished, f'{os.path.basename(output_dir)}/{param}/{name}'))
+        return future
+
+    def data(self, output_dir, param, name, x0=None, x1=None):
+        '''plot data of a zoomed range in background (see plot_data)'''
+        return self._executor.submit(plot_data, output_dir, param, name,
+                                     x0, x1, self.points, self.method)
+
+    def data_slice(self, output_dir, valve, sensor, param='primary', **kwargs):
+        '''samples of a sensor in background (see data_slice)'''
+        return self._executor.submit(data_slice, output_dir, valve, sensor,
+                                     param, **kwargs)
+
+    def _finished(self, name, future):
+        try:
+            _, secs = future.result()
+            self.log.info(f'Plot {name} rendered in {secs:.2f}s')
+        except Exception as exc:
+            self.log.fail(f'Plot {name} failed: {exc}')
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class PlotCache:
+    '''LRU cache of rendered plots bounded by their total size in bytes.
+       An entry is only valid for the data mtime (or version) it was
+       rendered from'''
+
+    def __init__(self, max_bytes=64*1024**2):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg):
+        max_mb = float(cfg.get_setting("export", "plot_cache_mb", fallback=64))
+
+        return cls(int(max_mb*1024**2))
+
+    def get(self, key, mtime):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != mtime:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, mtime, data):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = (mtime, data)
+            self.size += len(data)
+            # evict the least recently used plots
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+def export_results(output_dir):
+    '''write all csv files of an experiment'''
+    for param in PARAMS:
+        os.makedirs(os.path.join(output_dir, param), exist_ok=True)
+    table = tidy_table(storage.ColumnarResults(output_dir))
+    write_each_sensor(table, output_dir)
+    write_all_sensors(table, output_dir)
+
+
+def install_plotlyjs(js_dir):
+    '''copy the plotly.js bundled with the plotly package to js_dir, with a
+       gzip precompressed variant. The file name includes the version, so
+       it can be cached forever. Returns the file name'''
+    name = f'plotly-{plotly.offline.get_plotlyjs_version()}.min.js'
+    fn = os.path.join(js_dir, name)
+    if os.path.isfile(fn) and os.path.isfile(fn + '.gz'):
+        return name
+    content = plotly.offline.get_plotlyjs().encode('UTF-8')
+    for path, data in ((fn, content), (fn + '.gz', gzip.compress(content, 9))):
+        with open(path + '.tmp', 'wb') as outfile:
+            outfile.write(data)
+        os.replace(path + '.tmp', path)
+
+    return name
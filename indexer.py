@@ -1,21 +1,27 @@
 #!/usr/bin/env python3
 
-# Indexer v.1.0.1
+# Indexer v.1.0.2
 # Author: Josh Brunty (josh dot brunty at marshall dot edu)
 # DESCRIPTION: This script generates an .html index  of files within a directory (recursive is OFF by default). Start from current dir or from folder passed as first positional argument. Optionally filter by file types with --filter "*.py".
 
 # -handle symlinked files and folders: displayed with custom icons
 # By default only the current folder is processed.
 # Use -r or --recursive to process nested folders.
+# Use -i or --incremental to only regenerate folders whose entries changed.
 
 import argparse
 import datetime
+import json
 import os
 import sys
+from fnmatch import fnmatch
 from pathlib import Path
 from urllib.parse import quote
 
 DEFAULT_OUTPUT_FILE = 'index.html'
+# entries listed by the last run, kept in each dir (see --incremental)
+MANIFEST_FILE = '.index.json'
+MANIFEST_VERSION = 1
 
 
 def process_dir(top_dir, opts):
@@ -23,20 +29,50 @@ def process_dir(top_dir, opts):
 
     path_top_dir: Path
     path_top_dir = Path(top_dir)
-    index_file = None
 
     index_path = Path(path_top_dir, opts.output_file)
+    manifest_path = Path(path_top_dir, MANIFEST_FILE)
 
     if opts.verbose:
         print(f'Traversing dir {path_top_dir.absolute()}')
 
     try:
-        index_file = open(index_path, 'w', encoding='utf-8')
-    except Exception as e:
-        print('cannot create file %s %s' % (index_path, e))
+        entries = scan_dir(path_top_dir)
+    except OSError as e:
+        print('cannot read dir %s %s' % (path_top_dir, e))
         return
 
-    index_file.write("""<!DOCTYPE html>
+    # process directories first if recursive option is set, creating their
+    # index changes the mtime shown here
+    if opts.recursive:
+        for entry in entries:
+            if entry['is_dir'] and fnmatch(entry['name'], glob_patt):
+                path_entry = Path(path_top_dir, entry['name'])
+                process_dir(path_entry, opts)
+                try:
+                    entry['mtime_ns'] = path_entry.stat().st_mtime_ns
+                except OSError:
+                    pass
+
+    entries = [entry for entry in entries
+               if fnmatch(entry['name'], glob_patt)
+               and entry['name'].lower() != opts.output_file.lower()]
+    # sort dirs first
+    entries.sort(key=lambda e: (e['is_file'] or e['virtual'], e['name']))
+
+    # nothing changed since the last (incremental) run
+    manifest = {'version': MANIFEST_VERSION, 'filter': glob_patt,
+                'entries': entries}
+    if getattr(opts, 'incremental', False) and index_path.is_file():
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                if json.load(f) == manifest:
+                    return
+        except (OSError, ValueError):
+            pass
+
+    index_file = []
+    index_file.append("""<!DOCTYPE html>
 <html>
 <head>
     <meta charset="utf-8">
@@ -269,23 +305,16 @@ def process_dir(top_dir, opts):
                          </tr>
                  """)
 
-    # sort dirs first
-    sorted_entries = sorted(path_top_dir.glob(
-        glob_patt), key=lambda p: (p.is_file(), p.name))
-
     # desc script tag
     desc = ''
     script_tag = ''
 
-    entry: Path
-    for entry in sorted_entries:
-        # don't include index.html in the file listing
-        if entry.name.lower() == opts.output_file.lower():
-            continue
+    for entry in entries:
+        path_entry = Path(path_top_dir, entry['name'])
 
         # add page/experiment description
-        if 'desc.txt' in entry.name.lower():
-            with open(entry, 'r', encoding="UTF-8") as f:
+        if 'desc.txt' in entry['name'].lower():
+            with open(path_entry, 'r', encoding="UTF-8") as f:
                 desc = f.read()
 
             script_tag = """
@@ -296,64 +325,52 @@ def process_dir(top_dir, opts):
     });
 </script>"""
 
-        # process directories if recursive option is set
-        if entry.is_dir() and opts.recursive:
-            process_dir(entry, opts)
+        virtual = entry['virtual']
 
         # From Python 3.6, os.access() accepts path-like objects
-        if (not entry.is_symlink()) and not os.access(str(entry), os.W_OK):
+        if not virtual and (not entry['is_symlink']) and not os.access(str(path_entry), os.W_OK):
             print(
-                f"*** WARNING *** entry {entry.absolute()} is not writable! SKIPPING!")
+                f"*** WARNING *** entry {path_entry.absolute()} is not writable! SKIPPING!")
             continue
         if opts.verbose:
-            print(f'{entry.absolute()}')
+            print(f'{path_entry.absolute()}')
 
-        size_bytes = -1  # is a folder
+        size_bytes = entry['size']
         size_pretty = '&mdash;'
         last_modified = '-'
         last_modified_human_readable = '-'
         last_modified_iso = ''
-        try:
-            if entry.is_file():
-                size_bytes = entry.stat().st_size
-                size_pretty = pretty_size(size_bytes)
-
-            if entry.is_dir() or entry.is_file():
-                last_modified = datetime.datetime.fromtimestamp(
-                    entry.stat().st_mtime).replace(microsecond=0)
-                last_modified_iso = last_modified.isoformat()
-                last_modified_human_readable = last_modified.strftime("%c")
-
-        except Exception as e:
-            print('ERROR accessing file name:', e, entry)
-            continue
+        if entry['is_file']:
+            size_pretty = pretty_size(size_bytes)
 
-        entry_path = str(entry.name)
+        # virtual plots have the same date as the data they are rendered from
+        if entry['mtime_ns'] is not None:
+            last_modified = datetime.datetime.fromtimestamp(
+                entry['mtime_ns'] / 1e9).replace(microsecond=0)
+            last_modified_iso = last_modified.isoformat()
+            last_modified_human_readable = last_modified.strftime("%c")
 
-        if entry.is_dir() and not entry.is_symlink():
-            entry_type = 'folder'
+        entry_path = str(entry['name'])
+        entry_type = get_entry_type(entry)
+
+        if entry_type == 'folder':
             if os.name not in ('nt',):
                 # append trailing slash to dirs, unless it's windows
-                entry_path = os.path.join(entry.name, '')
+                entry_path = os.path.join(entry['name'], '')
 
-        elif entry.is_dir() and entry.is_symlink():
-            entry_type = 'folder-shortcut'
-            print('dir-symlink', entry.absolute())
+        elif entry_type == 'folder-shortcut':
+            print('dir-symlink', path_entry.absolute())
 
-        elif entry.is_file() and entry.is_symlink():
-            entry_type = 'file-shortcut'
-            print('file-symlink', entry.absolute())
+        elif entry_type == 'file-shortcut':
+            print('file-symlink', path_entry.absolute())
 
-        else:
-            entry_type = 'file'
-
-        index_file.write(f"""
+        index_file.append(f"""
         <tr class="file">
             <td></td>
             <td>
                 <a href="{quote(entry_path)}">
                     <svg width="1.5em" height="1em" version="1.1" viewBox="0 0 265 323"><use xlink:href="#{entry_type}"></use></svg>
-                    <span class="name">{entry.name}</span>
+                    <span class="name">{entry['name']}</span>
                 </a>
             </td>
             <td data-order="{size_bytes}">{size_pretty}</td>
@@ -362,7 +379,7 @@ def process_dir(top_dir, opts):
         </tr>
 """)
 
-    index_file.write("""
+    index_file.append("""
             </tbody>
         </table>
     </div>
@@ -370,8 +387,111 @@ def process_dir(top_dir, opts):
 """f'{script_tag}'"""
 </body>
 </html>""")
-    if index_file:
-        index_file.close()
+
+    write_if_changed(index_path, ''.join(index_file))
+    if getattr(opts, 'incremental', False):
+        # written in place, replacing it would change the dir mtime
+        write_if_changed(manifest_path, json.dumps(manifest))
+
+
+def write_if_changed(path, text):
+    '''write text to path unless it already has exactly this contents'''
+    data = text.encode('utf-8')
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+    try:
+        with open(path, 'wb') as f:
+            f.write(data)
+    except Exception as e:
+        print('cannot create file %s %s' % (path, e))
+        return False
+
+    return True
+
+
+def scan_dir(path_dir):
+    '''entries of path_dir (name, type, size and mtime) with a single
+       stat per entry, plus the virtual plots of the dir. Hidden entries
+       (the .index.json manifests...) are not listed'''
+    entries = []
+    with os.scandir(path_dir) as it:
+        for dir_entry in it:
+            if dir_entry.name.startswith('.'):
+                continue
+            try:
+                is_file = dir_entry.is_file()
+                is_dir = dir_entry.is_dir()
+                # broken symlinks have neither size nor date
+                st = dir_entry.stat() if is_file or is_dir else None
+            except OSError as e:
+                print('ERROR accessing file name:', e, dir_entry.path)
+                continue
+            entries.append({'name': dir_entry.name,
+                            'is_file': is_file,
+                            'is_dir': is_dir,
+                            'is_symlink': dir_entry.is_symlink(),
+                            'size': st.st_size if is_file else -1,
+                            'mtime_ns': st.st_mtime_ns if st else None,
+                            'virtual': False})
+
+    return entries + virtual_plots(path_dir, entries)
+
+
+def get_entry_type(entry):
+    '''icon of a scan_dir entry: folder, folder-shortcut, file-shortcut or file'''
+    if entry['is_dir']:
+        return 'folder-shortcut' if entry['is_symlink'] else 'folder'
+    if entry['is_file'] and entry['is_symlink']:
+        return 'file-shortcut'
+    return 'file'
+
+
+# sort keys of listings, dirs first unless sorted by date
+SORT_KEYS = {
+    'name': lambda e: (e['is_file'] or e['virtual'], e['name']),
+    'size': lambda e: (e['is_file'] or e['virtual'], e['size'], e['name']),
+    'mtime': lambda e: (e['mtime_ns'] or 0, e['name']),
+}
+
+
+def list_dir(path_dir, sort='name', reverse=False, output_file=DEFAULT_OUTPUT_FILE):
+    '''compact listing of path_dir for the web pages: the dir description
+       (desc.txt) and one [name, type, size, mtime] row per entry
+       (size -1 for dirs and plots not on disk, mtime in seconds)'''
+    entries = [entry for entry in scan_dir(path_dir)
+               if entry['name'].lower() != output_file.lower()]
+    entries.sort(key=SORT_KEYS[sort], reverse=reverse)
+
+    desc = ''
+    if any(entry['name'] == 'desc.txt' for entry in entries):
+        with open(Path(path_dir, 'desc.txt'), 'r', encoding='UTF-8') as f:
+            desc = f.read()
+    rows = [[entry['name'], get_entry_type(entry), entry['size'],
+             None if entry['mtime_ns'] is None else entry['mtime_ns'] // 10**9]
+            for entry in entries]
+
+    return desc, rows
+
+
+def virtual_plots(path_dir, entries):
+    '''html plots the web server renders on request (one for each csv file)
+       in the primary/secondary dirs of experiments with a columnar store'''
+    path_dir = Path(path_dir)
+    if path_dir.name not in ('primary', 'secondary') or \
+            not Path(path_dir.parent, 'results', 'manifest.json').is_file():
+        return []
+
+    names = {entry['name'] for entry in entries}
+    return [dict(entry, name=entry['name'][:-4] + '.html', is_file=False,
+                 size=-1, virtual=True)
+            for entry in entries
+            if entry['is_file'] and entry['name'].endswith('.csv')
+            and entry['name'][:-4] + '.html' not in names]
 
 
 # bytes pretty-printing
@@ -428,6 +548,12 @@ Email josh dot brunty at marshall dot edu for additional help. ''')
                         help="recursively process nested dirs (FALSE by default)",
                         required=False)
 
+    parser.add_argument('--incremental', '-i',
+                        action='store_true',
+                        help='only regenerate indexes of dirs whose entries changed '
+                             'since the last run (FALSE by default)',
+                        required=False)
+
     parser.add_argument('--verbose', '-v',
                         action='store_true',
                         help='***WARNING: can take longer time with complex file tree structures on slow terminals***'
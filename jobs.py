@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 by bgeneto <b g e n e t o @ g m a i l . c o m>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__doc__ = """
+Persistent queue of experiments, run one after the other.
+
+Experiments submitted while another one runs wait in the queue, they can
+be reordered, removed or cancelled. A worker thread runs the acquisition
+of the queued jobs back to back: the post-processing of a finished job
+(columnar store, csv files, indexes...) runs in a second thread while the
+next job is already acquiring. The queue is saved to a json file on every
+change, so queued jobs survive a restart:
+
+    def run(job):
+        ...  # acquisition, calls job.progress(record) for every slot
+        return lambda: ...  # post-processing, or None
+
+    queue = JobQueue('jobs.json', run)
+    queue.start()
+    queue.submit('my experiment', 'bgeneto', params, slots=64, estimate=320)
+
+Classes:
+
+    Job
+    JobQueue
+    JobCancelled
+
+Misc variables:
+
+    __version__
+    __author__
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent import futures
+from datetime import datetime
+
+__author__ = "bgeneto"
+__copyright__ = "Copyright 2022, bgeneto"
+__credits__ = ["bgeneto"]
+__license__ = "GPL"
+__maintainer__ = "Bernhard Enders"
+__email__ = "b g e n e t o @ d u c k . c o m"
+__version__ = "1.0.0"
+__modified__ = "20261016"
+
+JOBS_FILE = 'jobs.json'
+# queued -> running -> processing -> done | failed | cancelled
+FINISHED = ('done', 'failed', 'cancelled')
+# finished jobs used to correct the estimates
+ESTIMATE_HISTORY = 5
+
+
+class JobCancelled(Exception):
+    '''raised in the acquisition thread when its job is cancelled'''
+
+
+class Job:
+    '''An experiment of the queue: description (name), user, the experiment
+       settings at submit time (params), expected slots and duration'''
+
+    FIELDS = ('id', 'name', 'user', 'params', 'slots', 'estimate', 'state',
+              'submitted', 'started', 'acquired', 'finished', 'done_slots',
+              'output_dir', 'error')
+
+    def __init__(self, id, name='', user='', params=None, slots=0,
+                 estimate=0.0, state='queued', submitted=None, started=None,
+                 acquired=None, finished=None, done_slots=0, output_dir=None,
+                 error=None):
+        self.id = id
+        self.name = name
+        self.user = user
+        self.params = {} if params is None else params
+        self.slots = slots
+        self.estimate = estimate
+        self.state = state
+        self.submitted = time.time() if submitted is None else submitted
+        self.started = started
+        # end of the acquisition (finished includes the post-processing)
+        self.acquired = acquired
+        self.finished = finished
+        self.done_slots = done_slots
+        self.output_dir = output_dir
+        self.error = error
+        self.cancelled = threading.Event()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{key: data[key] for key in cls.FIELDS if key in data})
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    def progress(self, record):
+        '''readings writer listener: counts the slots read and stops the
+           acquisition (raising JobCancelled) if the job was cancelled'''
+        self.done_slots += 1
+        if self.cancelled.is_set():
+            raise JobCancelled(f'job {self.id} cancelled')
+
+
+class JobQueue:
+    '''Jobs run by run(job) in a worker thread, in queue order. run may
+       return a callable that post-processes the job results, it is called
+       in another thread so the next job starts right away. idle() is
+       called by the worker once no job is left to run (e.g. to release
+       the devices kept for back-to-back jobs). The jobs are saved to path,
+       keeping the last history finished jobs'''
+
+    def __init__(self, path, run, history=100, log=None, idle=None):
+        self.path = path
+        self.run = run
+        self.history = history
+        self.log = log
+        self.idle = idle
+        self.jobs = []
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._last_id = 0
+        self._post = futures.ThreadPoolExecutor(max_workers=1)
+        self.__load()
+
+    def __load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='UTF-8') as f:
+                self.jobs = [Job.from_dict(data) for data in json.load(f)]
+        except (OSError, ValueError, TypeError) as exc:
+            print(f'ERROR: unable to read the jobs file {self.path}: {exc}')
+            return
+        for job in self.jobs:
+            if job.state in ('running', 'processing'):
+                job.state = 'failed'
+                job.error = 'interrupted by a server restart'
+                job.finished = job.finished or time.time()
+        self._last_id = max([job.id for job in self.jobs], default=0)
+
+    def __save(self):
+        '''write the jobs file (call with the lock held)'''
+        finished = [job for job in self.jobs if job.state in FINISHED]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            self.jobs.remove(job)
+        tmp_file = f'{self.path}.tmp'
+        try:
+            with open(tmp_file, 'w', encoding='UTF-8') as f:
+                json.dump([job.to_dict() for job in self.jobs], f, indent=1)
+            os.replace(tmp_file, self.path)
+        except OSError as exc:
+            print(f'ERROR: unable to write the jobs file {self.path}: {exc}')
+
+    def start(self):
+        self._thread = threading.Thread(target=self.__worker, name='JobQueue',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        '''cancel the running job and wait for it (and its post-processing)'''
+        with self._cond:
+            self._stopping = True
+            for job in self.jobs:
+                if job.state == 'running':
+                    job.cancelled.set()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._post.shutdown(wait=True)
+
+    def submit(self, name, user, params, slots=0, estimate=0.0):
+        with self._cond:
+            self._last_id += 1
+            job = Job(self._last_id, name, user, params, slots, estimate)
+            self.jobs.append(job)
+            self.__save()
+            self._cond.notify_all()
+        return job
+
+    def get(self, job_id):
+        for job in self.jobs:
+            if job.id == job_id:
+                return job
+        return None
+
+    def move(self, job_id, position):
+        '''move a queued job to position (0 is next) among the queued jobs'''
+        with self._cond:
+            job = self.get(job_id)
+            if job is None or job.state != 'queued':
+                return False
+            queued = [other for other in self.jobs if other.state == 'queued']
+            queued.remove(job)
+            queued.insert(max(0, min(position, len(queued))), job)
+            others = [other for other in self.jobs if other.state != 'queued']
+            self.jobs = others + queued
+            self.__save()
+        return True
+
+    def remove(self, job_id):
+        '''remove a queued or finished job, cancel a running one'''
+        with self._cond:
+            job = self.get(job_id)
+            if job is None or job.state == 'processing':
+                return False
+            if job.state == 'running':
+                job.cancelled.set()
+            else:
+                self.jobs.remove(job)
+                self.__save()
+        return True
+
+    def cancel(self, job_id=None):
+        '''cancel the running job (if it is job_id), its readings are kept'''
+        with self._cond:
+            for job in self.jobs:
+                if job.state == 'running' and job_id in (None, job.id):
+                    job.cancelled.set()
+                    return True
+        return False
+
+    def status(self):
+        '''the jobs as dicts, with the seconds remaining (running and
+           queued jobs) and the expected end time (eta)'''
+        with self._cond:
+            jobs = [job.to_dict() for job in self.jobs]
+            # how long the last jobs took compared to their estimates
+            ratios = [(job['acquired'] - job['started']) / job['estimate']
+                      for job in jobs if job['state'] == 'done'
+                      and job['estimate'] and job['started'] and job['acquired']]
+            ratios = ratios[-ESTIMATE_HISTORY:]
+            factor = sum(ratios) / len(ratios) if ratios else 1.0
+            now = time.time()
+            end = now
+            for job in jobs:
+                job.pop('params')
+                job['remaining'] = None
+                if job['state'] == 'running':
+                    elapsed = now - job['started']
+                    if job['done_slots'] and job['slots']:
+                        remaining = elapsed / job['done_slots'] * \
+                            max(0, job['slots'] - job['done_slots'])
+                    else:
+                        remaining = max(0.0, job['estimate'] * factor - elapsed)
+                elif job['state'] == 'queued':
+                    remaining = job['estimate'] * factor
+                else:
+                    continue
+                end += remaining
+                job['remaining'] = round(remaining)
+                job['eta'] = datetime.fromtimestamp(end).isoformat(timespec='seconds')
+
+        return jobs
+
+    def __next(self):
+        for job in self.jobs:
+            if job.state == 'queued':
+                return job
+        return None
+
+    def __worker(self):
+        busy = False
+        while True:
+            with self._cond:
+                waiting = self._stopping or self.__next() is None
+            if waiting and busy:
+                busy = False
+                if self.idle is not None:
+                    try:
+                        self.idle()
+                    except Exception as exc:
+                        print(f'ERROR: job queue idle callback failed: {exc}')
+            with self._cond:
+                while not self._stopping and self.__next() is None:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                job = self.__next()
+                job.state = 'running'
+                job.started = time.time()
+                self.__save()
+
+            busy = True
+            post = None
+            try:
+                post = self.run(job)
+            except JobCancelled:
+                pass
+            except (Exception, SystemExit) as exc:
+                job.error = str(exc) or exc.__class__.__name__
+            with self._cond:
+                job.state = 'processing'
+                job.acquired = time.time()
+                self.__save()
+            if post is None:
+                self.__finished(job)
+                continue
+            try:
+                self._post.submit(self.__post_process, job, post)
+            except RuntimeError:
+                # stopped while acquiring, post-process right here
+                self.__post_process(job, post)
+
+    def __post_process(self, job, post):
+        try:
+            post()
+        except Exception as exc:
+            job.error = job.error or str(exc)
+            if self.log is not None:
+                self.log.fail(f'Job {job.id} post-processing failed: {exc}')
+        self.__finished(job)
+
+    def __finished(self, job):
+        with self._cond:
+            if job.error is not None:
+                job.state = 'failed'
+            elif job.cancelled.is_set():
+                job.state = 'cancelled'
+            else:
+                job.state = 'done'
+            job.finished = time.time()
+            self.__save()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 by bgeneto <b g e n e t o @ g m a i l . c o m>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__doc__ = """
+Live stream of the readings to the web browsers while an experiment runs.
+
+The acquisition thread is the single producer: every slot written by the
+readings writer (see storage.py) is summarized and queued, publishing
+never blocks. The tornado io loop sends the queued summaries in batches
+to every viewer, viewers that do not keep up miss batches and are
+eventually disconnected:
+
+    broadcaster = Broadcaster()
+    writer = ReadingsWriter(output_dir, listeners=[broadcaster.publish])
+
+Classes:
+
+    Broadcaster
+
+Functions:
+
+    slot_summary(record, raw_points=0)
+
+Misc variables:
+
+    __version__
+    __author__
+"""
+
+import collections
+import json
+import math
+import threading
+
+import numpy as np
+import tornado.ioloop
+import tornado.websocket
+
+__author__ = "bgeneto"
+__copyright__ = "Copyright 2022, bgeneto"
+__credits__ = ["bgeneto"]
+__license__ = "GPL"
+__maintainer__ = "Bernhard Enders"
+__email__ = "b g e n e t o @ d u c k . c o m"
+__version__ = "1.0.0"
+__modified__ = "20261016"
+
+PARAMS = ('primary', 'secondary')
+
+
+def _stats(values):
+    '''mean, std, min and max of the finite values (None if there are none)'''
+    arr = np.asarray(values, dtype=float)
+    arr = arr[np.isfinite(arr)]
+    if len(arr) == 0:
+        return dict(mean=None, std=None, min=None, max=None)
+
+    return dict(mean=float(arr.mean()), std=float(arr.std()),
+                min=float(arr.min()), max=float(arr.max()))
+
+
+def slot_summary(record, raw_points=0):
+    '''summary of a slot record, with at most raw_points of its samples
+       (evenly decimated) if raw_points is not zero'''
+    summary = {key: record[key]
+               for key in ('cycle', 'valve', 'sensor', 'loop', 'time', 'dwell')}
+    summary['samples'] = len(record['primary'])
+    for param in PARAMS:
+        summary[param] = _stats(record[param])
+        if raw_points > 0:
+            values = record[param]
+            step = max(1, -(-len(values) // raw_points))
+            summary[param]['raw'] = [val if math.isfinite(val) else None
+                                     for val in values[::step]]
+
+    return summary
+
+
+class Broadcaster:
+    '''Fan-out of slot summaries from the acquisition thread to websocket
+       viewers. A viewer with max_pending unsent batches misses the next
+       ones, after max_drops batches missed in a row it is disconnected'''
+
+    def __init__(self, interval=0.5, raw_points=100, max_pending=4,
+                 max_drops=20, max_queue=1000):
+        self.interval = interval
+        self.raw_points = raw_points
+        self.max_pending = max_pending
+        self.max_drops = max_drops
+        # viewer -> dict(raw, pending, dropped)
+        self.clients = {}
+        # summaries waiting for the next batch (oldest are lost if full)
+        self._queue = collections.deque(maxlen=max_queue)
+        self._lock = threading.Lock()
+        self._callback = None
+
+    def start(self):
+        '''start sending batches (call from the io loop thread)'''
+        self._callback = tornado.ioloop.PeriodicCallback(
+            self._flush, self.interval*1000)
+        self._callback.start()
+
+    def stop(self):
+        if self._callback is not None:
+            self._callback.stop()
+
+    def register(self, client, raw=False):
+        self.clients[client] = dict(raw=raw, pending=0, dropped=0)
+
+    def unregister(self, client):
+        self.clients.pop(client, None)
+
+    def publish(self, record):
+        '''queue a slot record (called from the acquisition thread)'''
+        if not self.clients:
+            return
+        summary = slot_summary(record, self.raw_points)
+        with self._lock:
+            self._queue.append(summary)
+
+    def _flush(self):
+        with self._lock:
+            batch = list(self._queue)
+            self._queue.clear()
+        if not batch or not self.clients:
+            return
+        messages = {True: json.dumps(batch)}
+        for summary in batch:
+            for param in PARAMS:
+                summary[param].pop('raw', None)
+        messages[False] = json.dumps(batch)
+
+        for client, state in list(self.clients.items()):
+            if state['pending'] >= self.max_pending:
+                state['dropped'] += 1
+                if state['dropped'] >= self.max_drops:
+                    self.unregister(client)
+                    client.close(1008, 'too slow')
+                continue
+            try:
+                future = client.write_message(messages[state['raw']])
+            except tornado.websocket.WebSocketClosedError:
+                self.unregister(client)
+                continue
+            state['dropped'] = 0
+            state['pending'] += 1
+            future.add_done_callback(lambda _, state=state: state.update(
+                pending=state['pending'] - 1))
@@ -20,14 +20,23 @@
 __doc__ = """
 Create, read and write to config file (.ini file).
 
+The parsed file is kept in memory and only parsed again when the file
+changes (mtime) or after reload(). Writes replace the file atomically.
+
 Classes:
 
     MyConfig
 
 Functions:
 
+    get_ip()
     get_config()
-    get_setting(section, end)
+    get_setting(section, setting, fallback)
+    get_int(section, setting, fallback)
+    get_float(section, setting, fallback)
+    get_list(section, setting, fallback, sep)
+    update(settings)
+    reload()
     read_config()
 
 Misc variables:
@@ -36,8 +45,11 @@ Misc variables:
     __author__
 """
 
+import io
 import os
 import socket
+import threading
+import time
 from configparser import ConfigParser
 
 import serial
@@ -49,11 +61,18 @@ __license__ = "GPL"
 __maintainer__ = "Bernhard Enders"
 __email__ = "b g e n e t o @ d u c k . c o m"
 __version__ = "1.0.0"
-__modified__ = "20220916"
+__modified__ = "20261016"
+
+# seconds the detected ip address is reused
+IP_TTL = 60
+_ip_cache = [None, 0.0]
 
 
 def get_ip():
-    '''get the ip address of the machine'''
+    '''get the ip address of the machine (cached for IP_TTL seconds)'''
+    ip, expires = _ip_cache
+    if ip is not None and time.monotonic() < expires:
+        return ip
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.settimeout(0)
     try:
@@ -64,6 +83,7 @@ def get_ip():
         ip = '127.0.0.1'
     finally:
         s.close()
+    _ip_cache[:] = [ip, time.monotonic() + IP_TTL]
 
     return ip
 
@@ -71,7 +91,10 @@ def get_ip():
 class MyConfig:
     def __init__(self, cfg_file='config.ini'):
         self.cfg_file = cfg_file
+        # parsed config file and its (mtime, size) when parsed
         self.config = None
+        self._stamp = None
+        self._lock = threading.RLock()
 
     def __ini_config(self):
         '''
@@ -85,6 +108,7 @@ class MyConfig:
         self.config.set("serial", "stopbits", str(serial.STOPBITS_ONE))
         self.config.set("serial", "bytesize", str(serial.EIGHTBITS))
         self.config.set("serial", "timeout", "1")
+        self.config.set("serial", "buffer_size", "65536")
         self.config.add_section("web")
         self.config.set("web", "port", "8080")
         self.config.set("web", "ip", get_ip())
@@ -102,68 +126,141 @@ class MyConfig:
         self.config.set("arduino2", "sensors", ";;;;;;;")
         self.config.set("arduino2", "valves", ";;;;;;;")
         self.config.set("arduino2", "invert_onoff", "0")
+        self.config.add_section("acquisition")
+        self.config.set("acquisition", "switch_delay", "0.1")
+        self.config.set("acquisition", "settle_time", "0.5")
+        self.config.set("acquisition", "dwell_samples", "0")
+        self.config.set("acquisition", "dwell_rstd", "0")
+        self.config.set("acquisition", "dwell_window", "5")
+        self.config.set("acquisition", "valve_settle", "0")
+        self.config.set("acquisition", "pipeline", "0")
+        self.config.set("acquisition", "interlocks", "valves:read")
+        self.config.set("acquisition", "fsync_interval", "5")
+        self.config.add_section("export")
+        self.config.set("export", "plot_workers", "2")
+        self.config.set("export", "plot_cache_mb", "64")
+        self.config.set("export", "plot_points", "2000")
+        self.config.set("export", "plot_downsample", "lttb")
         self.__write_config_file()
 
+    def __file_stamp(self):
+        try:
+            st = os.stat(self.cfg_file)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
     def __write_config_file(self):
         '''
-        Write the config file
+        Write the config file (atomically, readers never see a partial file)
         '''
-        with open(self.cfg_file, "w", encoding='UTF-8') as config_file:
-            try:
+        tmp_file = f'{self.cfg_file}.tmp'
+        try:
+            with open(tmp_file, "w", encoding='UTF-8') as config_file:
                 self.config.write(config_file)
-            except Exception as _:
-                print("ERROR: Failed creating initial config file. Check permissions.")
-                os._exit(os.EX_CONFIG)
+            os.replace(tmp_file, self.cfg_file)
+        except Exception as _:
+            print("ERROR: Failed writing config file. Check permissions.")
+            os._exit(os.EX_CONFIG)
+        self._stamp = self.__file_stamp()
 
-    def get_config(self):
+    def __current(self):
         '''
-        Returns the config object
+        Returns the parsed config file, parsing it again if it changed
         '''
-        if not os.path.isfile(self.cfg_file):
-            self.__ini_config()
+        with self._lock:
+            if self.config is None or self.__file_stamp() != self._stamp:
+                if not os.path.isfile(self.cfg_file):
+                    self.__ini_config()
+                self.config = ConfigParser()
+                try:
+                    self._stamp = self.__file_stamp()
+                    self.config.read(self.cfg_file)
+                except Exception as exp:
+                    print(str(exp))
+                    # auto (re)create config file in the next run
+                    self.__ini_config()
+                    os._exit(os.EX_CONFIG)
+            # update the ip address (written here, update() reads the
+            # config through this method)
+            ip = get_ip()
+            if self.config.get('web', 'ip', fallback=None) != ip:
+                if not self.config.has_section('web'):
+                    self.config.add_section('web')
+                self.config.set('web', 'ip', ip)
+                self.__write_config_file()
 
-        self.config = ConfigParser()
+            return self.config
 
-        try:
-            self.config.read(self.cfg_file)
-            # update the ip address
-            ip = self.config.get('web', 'ip')
-            if ip != get_ip():
-                self.config.set('web', 'ip', get_ip())
-                self.__write_config_file()
-        except Exception as exp:
-            print(str(exp))
-            # auto (re)create config file in the next run
-            self.__ini_config()
-            os._exit(os.EX_CONFIG)
+    def reload(self):
+        '''
+        Parse the config file again on next access
+        '''
+        with self._lock:
+            self.config = None
+
+    def get_config(self):
+        '''
+        Returns a copy of the config object (changes are only saved
+        by writing it to cfg_file, prefer update())
+        '''
+        text = io.StringIO()
+        with self._lock:
+            self.__current().write(text)
+        config = ConfigParser()
+        config.read_string(text.getvalue())
 
-        return self.config
+        return config
 
-    def get_setting(self, section, setting):
+    def update(self, settings):
         '''
-        Return a setting value
+        Change settings ({section: {setting: value}}) and write them
         '''
-        self.config = self.get_config()
-        value = None
+        with self._lock:
+            config = self.__current()
+            for section, values in settings.items():
+                if not config.has_section(section):
+                    config.add_section(section)
+                for setting, value in values.items():
+                    config.set(section, setting, str(value))
+            self.__write_config_file()
+
+    def get_setting(self, section, setting, fallback=None):
+        '''
+        Return a setting value (or fallback if not present)
+        '''
+        value = fallback
         try:
-            value = self.config.get(section, setting)
+            value = self.__current().get(section, setting)
         except Exception as exp:
-            print(str(exp))
-            pass
+            if fallback is None:
+                print(str(exp))
 
         return value
 
+    def get_int(self, section, setting, fallback=None):
+        value = self.get_setting(section, setting, fallback)
+        return None if value is None else int(value)
+
+    def get_float(self, section, setting, fallback=None):
+        value = self.get_setting(section, setting, fallback)
+        return None if value is None else float(value)
+
+    def get_list(self, section, setting, fallback=None, sep=';'):
+        value = self.get_setting(section, setting, fallback)
+        return None if value is None else str(value).split(sep)
+
     def read_config(self):
         ser_params = {
             'port': self.get_setting("serial", "port"),
-            'baudrate': int(self.get_setting("serial", "baudrate")),
+            'baudrate': self.get_int("serial", "baudrate"),
             'parity': str(self.get_setting("serial", "parity")),
-            'stopbits': int(self.get_setting("serial", "stopbits")),
-            'bytesize': int(self.get_setting("serial", "bytesize")),
-            'timeout': int(self.get_setting("serial", "timeout"))
+            'stopbits': self.get_int("serial", "stopbits"),
+            'bytesize': self.get_int("serial", "bytesize"),
+            'timeout': self.get_int("serial", "timeout")
         }
         web_params = {
-            'web_port': int(self.get_setting("web", "port")),
+            'web_port': self.get_int("web", "port"),
             'web_ip': self.get_setting("web", "ip")
         }
 
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 by bgeneto <b g e n e t o @ g m a i l . c o m>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__doc__ = """
+In-process stand-in for a pymata4 (FirmataExpress) arduino board.
+
+Every pin write is recorded with a timestamp, so the actuation timeline
+of an experiment can be inspected afterwards:
+
+    arduinos = arduinos_connect(cfg, backend=FakeBoard)
+
+Classes:
+
+    FakeBoard
+"""
+
+import threading
+
+import clocks
+
+__author__ = "bgeneto"
+__copyright__ = "Copyright 2022, bgeneto"
+__credits__ = ["bgeneto"]
+__license__ = "GPL"
+__maintainer__ = "Bernhard Enders"
+__email__ = "b g e n e t o @ d u c k . c o m"
+__version__ = "1.0.0"
+__modified__ = "20261016"
+
+
+class FakeBoard:
+    '''Records pin modes and digital writes instead of driving a real board.
+       Accepts the same constructor arguments as pymata4.Pymata4 but
+       never waits for the (non-existent) arduino to reset.
+       Timestamps are taken from the device layer clock (see clocks.py).
+    '''
+
+    def __init__(self, arduino_instance_id=1, arduino_wait=4, **kwargs):
+        self.arduino_instance_id = arduino_instance_id
+        self.arduino_wait = arduino_wait
+        self.pin_modes = {}
+        self.pin_values = {}
+        # (timestamp, pin, value) of every digital write
+        self.timeline = []
+        self.is_shutdown = False
+        self._lock = threading.Lock()
+
+    def set_pin_mode_digital_output(self, pin_number):
+        with self._lock:
+            self.pin_modes[pin_number] = 'output'
+
+    def digital_write(self, pin, value):
+        with self._lock:
+            if self.is_shutdown:
+                raise RuntimeError('board already shutdown')
+            self.pin_values[pin] = value
+            self.timeline.append((clocks.monotonic(), pin, value))
+
+    # pymata4 also provides a write without port manipulation
+    digital_pin_write = digital_write
+
+    def shutdown(self):
+        self.is_shutdown = True
+
+    def writes(self, pin=None):
+        '''return the recorded timeline, optionally for a single pin'''
+        with self._lock:
+            if pin is None:
+                return list(self.timeline)
+            return [w for w in self.timeline if w[1] == pin]
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 by bgeneto <b g e n e t o @ g m a i l . c o m>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__doc__ = """
+pyserial url handler that emulates a TH2816B LCR meter.
+
+URL format:
+
+    th2816b://[?option[=value][&option[=value]]...]
+
+Options:
+
+    aperture  initial aperture (fast, med, slow), default: slow
+    trigger   initial trigger source (int, man), default: int
+    rate      readings per second, overrides the aperture rate
+    primary   primary parameter mean value, default: 1e-09
+    secondary secondary parameter mean value, default: 0.01
+    noise     relative gaussian noise (std/mean), default: 0.001
+    dropout   probability of a reading being lost, default: 0.0
+    garbage   probability of a reading being garbled, default: 0.0
+    seed      random generator seed, default: none
+"""
+
+import random
+import threading
+import urllib.parse as urlparse
+
+from serial.serialutil import (PortNotOpenError, SerialBase, SerialException,
+                               Timeout, to_bytes)
+
+import clocks
+
+__author__ = "bgeneto"
+__copyright__ = "Copyright 2022, bgeneto"
+__credits__ = ["bgeneto"]
+__license__ = "GPL"
+__maintainer__ = "Bernhard Enders"
+__email__ = "b g e n e t o @ d u c k . c o m"
+__version__ = "1.0.0"
+__modified__ = "20261016"
+
+# approximate number of readings per second for each aperture
+APERTURE_RATES = {'FAST': 20.0, 'MED': 10.0, 'SLOW': 3.0}
+
+# what the meter sends when a reading goes wrong on the wire
+GARBAGE_LINES = ['+1.2345', ',+1.23', 'APER SLOW', '*E:Invalid command', '']
+
+IDN = 'Tonghui,TH2816B,SIMULATOR,Ver1.0'
+
+
+class Serial(SerialBase):
+    '''Serial port implementation that simulates a TH2816B LCR meter'''
+
+    BAUDRATES = (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200)
+
+    def __init__(self, *args, **kwargs):
+        self.aperture = 'SLOW'
+        self.trigger = 'INT'
+        self.rate = None
+        self.primary = 1e-09
+        self.secondary = 0.01
+        self.noise = 0.001
+        self.dropout = 0.0
+        self.garbage = 0.0
+        self.seed = None
+        self.readings = 0  # number of readings taken so far
+        self._rng = random.Random()
+        self._cond = threading.Condition()
+        self._rx = bytearray()
+        self._cmd = bytearray()
+        self._next_due = None
+        self._cancel = False
+        self._clock = None
+        self._reader_waiting = False
+        super(Serial, self).__init__(*args, **kwargs)
+
+    def open(self):
+        '''Open port with current settings'''
+        if self._port is None:
+            raise SerialException(
+                "Port must be configured before it can be used.")
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        self.from_url(self.port)
+        self._rng.seed(self.seed)
+        self._reconfigure_port()
+        self._next_due = clocks.monotonic()
+        self.is_open = True
+        self.reset_input_buffer()
+        self.reset_output_buffer()
+        # follow the device layer clock when it is fast-forwarded
+        self._clock = clocks.get_clock()
+        self._clock.add_listener(self._time_advanced)
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self._clock.remove_listener(self._time_advanced)
+            with self._cond:
+                self._cond.notify_all()
+        super(Serial, self).close()
+
+    def _reconfigure_port(self):
+        '''Set communication parameters on opened port (all ignored)'''
+        if self._baudrate not in self.BAUDRATES:
+            raise ValueError(f"invalid baudrate: {self._baudrate!r}")
+
+    def from_url(self, url):
+        '''extract simulation options from an URL string'''
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "th2816b":
+            raise SerialException(
+                'expected a string in the form "th2816b://[?options]": '
+                f'not starting with th2816b:// ({parts.scheme!r})')
+        try:
+            for option, values in urlparse.parse_qs(parts.query, True).items():
+                if option == 'aperture':
+                    self._set_aperture(values[0])
+                elif option == 'trigger':
+                    self._set_trigger(values[0])
+                elif option in ('rate', 'primary', 'secondary',
+                                'noise', 'dropout', 'garbage'):
+                    setattr(self, option, float(values[0]))
+                elif option == 'seed':
+                    self.seed = int(values[0])
+                else:
+                    raise ValueError(f'unknown option: {option!r}')
+        except ValueError as e:
+            raise SerialException(
+                f'expected a string in the form "th2816b://[?options]": {e}')
+
+    #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
+
+    def _set_aperture(self, value):
+        value = value.upper()
+        for aperture in APERTURE_RATES:
+            if aperture.startswith(value[:3]):
+                self.aperture = aperture
+                return
+        raise ValueError(f'invalid aperture: {value!r}')
+
+    def _set_trigger(self, value):
+        value = value.upper()
+        if value not in ('INT', 'MAN', 'EXT', 'BUS'):
+            raise ValueError(f'invalid trigger source: {value!r}')
+        self.trigger = value
+        self._next_due = clocks.monotonic()
+
+    def _period(self):
+        '''time between two consecutive readings'''
+        rate = self.rate if self.rate else APERTURE_RATES[self.aperture]
+        return 1.0/rate
+
+    def _reading(self):
+        '''produce the next reading line (or nothing for a drop-out)'''
+        self.readings += 1
+        if self._rng.random() < self.dropout:
+            return None
+        if self._rng.random() < self.garbage:
+            return self._rng.choice(GARBAGE_LINES)
+        pri = self._rng.gauss(self.primary, abs(self.primary)*self.noise)
+        sec = self._rng.gauss(self.secondary, abs(self.secondary)*self.noise)
+        return f'{pri:+.5E},{sec:+.5E}'
+
+    def _send(self, line):
+        if line is not None:
+            self._rx += line.encode('utf-8') + b'\n'
+
+    def _generate(self):
+        '''emit every reading that is due since the last call'''
+        if self.trigger != 'INT':
+            return
+        now = clocks.monotonic()
+        period = self._period()
+        while self._next_due <= now:
+            self._send(self._reading())
+            self._next_due += period
+
+    def _time_advanced(self, clock):
+        '''the clock was fast-forwarded: emit what is due and give the
+           reader thread a chance to consume it before time moves on'''
+        with self._cond:
+            self._generate()
+            if self._rx:
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: self._reader_waiting and not self._rx
+                                    or not self.is_open, timeout=0.5)
+
+    def _handle_command(self, cmd):
+        '''understand the (few) SCPI commands we use'''
+        cmd = cmd.strip().upper()
+        if not cmd:
+            return
+        if cmd.startswith('APER'):
+            args = cmd.split()
+            if args[0].endswith('?'):
+                self._send(self.aperture)
+            elif len(args) > 1:
+                self._set_aperture(args[1])
+        elif cmd.startswith('TRIG:SOUR'):
+            args = cmd.split()
+            if args[0].endswith('?'):
+                self._send(self.trigger)
+            elif len(args) > 1:
+                self._set_trigger(args[1])
+        elif cmd in ('TRIG', '*TRG'):
+            if self.trigger != 'INT':
+                self._send(self._reading())
+        elif cmd == '*IDN?':
+            self._send(IDN)
+
+    #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
+
+    @property
+    def in_waiting(self):
+        '''Return the number of bytes currently in the input buffer'''
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._cond:
+            self._generate()
+            return len(self._rx)
+
+    def read(self, size=1):
+        '''Read size bytes, waiting for the next reading if required'''
+        if not self.is_open:
+            raise PortNotOpenError()
+        timeout = Timeout(self._timeout)
+        data = bytearray()
+        with self._cond:
+            self._cancel = False
+            while len(data) < size and self.is_open:
+                self._generate()
+                if self._rx:
+                    chunk = self._rx[:size - len(data)]
+                    del self._rx[:len(chunk)]
+                    data += chunk
+                    continue
+                if timeout.expired() or self._cancel:
+                    break
+                wait = timeout.time_left()
+                if self.trigger == 'INT':
+                    due = max(0.0, self._next_due - clocks.monotonic())
+                    wait = due if wait is None else min(wait, due)
+                self._reader_waiting = True
+                self._cond.notify_all()
+                self._cond.wait(wait)
+                self._reader_waiting = False
+        return bytes(data)
+
+    def cancel_read(self):
+        with self._cond:
+            self._cancel = True
+            self._cond.notify_all()
+
+    def write(self, data):
+        '''Parse the commands sent to the meter'''
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = to_bytes(data)
+        with self._cond:
+            self._cmd += data.replace(b'\r', b'\n')
+            while b'\n' in self._cmd:
+                cmd, _, self._cmd = self._cmd.partition(b'\n')
+                try:
+                    self._handle_command(cmd.decode('utf-8', 'replace'))
+                except ValueError:
+                    # invalid parameter, the meter just ignores it
+                    pass
+            self._cond.notify_all()
+        return len(data)
+
+    def reset_input_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._cond:
+            self._generate()
+            self._rx.clear()
+
+    def reset_output_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._cond:
+            self._cmd.clear()
+
+    def flush(self):
+        '''nothing to flush, commands are handled as soon as written'''
+
+    def _update_break_state(self):
+        pass
+
+    def _update_rts_state(self):
+        pass
+
+    def _update_dtr_state(self):
+        pass
+
+    @property
+    def cts(self):
+        return True
+
+    @property
+    def dsr(self):
+        return True
+
+    @property
+    def ri(self):
+        return False
+
+    @property
+    def cd(self):
+        return True
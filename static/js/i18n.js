@@ -70,11 +70,22 @@ $(function () {
               button: 'Start Experiment',
               clr_button: 'Clear',
               output: 'Data output',
-              ok_msg: 'Experiment started successfully!',
+              ok_msg: 'Experiment queued successfully!',
               log: 'Waiting for an experiment...',
               username: 'Username',
               exp_end: 'Stop',
               modal_msg: 'Experiment stopped successfully!',
+              live: 'Live readings',
+              live_cycle: 'Cycle',
+              live_samples: 'Samples',
+              live_primary: 'Primary (mean ± std)',
+              live_secondary: 'Secondary (mean ± std)',
+              jobs: 'Experiments queue',
+              jobs_name: 'Description',
+              jobs_state: 'State',
+              jobs_progress: 'Slots',
+              jobs_remaining: 'Remaining',
+              jobs_eta: 'Expected end',
             },
             page1: {
               title: 'Experiment Configuration',
@@ -127,6 +138,9 @@ $(function () {
             },
             page4: {
               title: 'Finished Experiments',
+              name: 'Name',
+              size: 'Size',
+              modified: 'Modified',
             },
             configure: {
               button: 'Configure'
@@ -180,11 +194,22 @@ $(function () {
               button: 'Iniciar Experimento',
               clr_button: 'Limpar',
               output: 'Saída de dados',
-              ok_msg: 'Experimento iniciado com sucesso!',
+              ok_msg: 'Experimento adicionado à fila com sucesso!',
               log: 'Aguardando novo experimento...',
               username: 'Nome do usuário',
               exp_end: 'Parar',
               modal_msg: 'Experimento encerrado com sucesso!',
+              live: 'Leituras em tempo real',
+              live_cycle: 'Ciclo',
+              live_samples: 'Amostras',
+              live_primary: 'Primário (média ± desvio)',
+              live_secondary: 'Secundário (média ± desvio)',
+              jobs: 'Fila de experimentos',
+              jobs_name: 'Descrição',
+              jobs_state: 'Estado',
+              jobs_progress: 'Slots',
+              jobs_remaining: 'Restante',
+              jobs_eta: 'Término previsto',
             },
             page1: {
               title: 'Configuração do Experimento',
@@ -236,6 +261,9 @@ $(function () {
             },
             page4: {
               title: 'Experimentos Concluídos',
+              name: 'Nome',
+              size: 'Tamanho',
+              modified: 'Modificado',
             },
             configure: {
               button: 'Configure'
@@ -0,0 +1,62 @@
+/**
+ * Experiments queue (see jobs.py), refreshed every few seconds from /jobs.
+ * Queued jobs can be moved up or removed, the running one cancelled
+ */
+(function () {
+    const interval = 5 * 1000;
+
+    function duration(secs) {
+        if (secs === null || secs === undefined) {
+            return '-';
+        }
+        const hours = Math.floor(secs / 3600);
+        const mins = Math.floor((secs % 3600) / 60);
+        return (hours ? hours + 'h' : '') + mins + 'm' + (secs % 60) + 's';
+    }
+
+    function action(method, url) {
+        fetch(url, { method: method }).then(refresh);
+    }
+
+    function render(jobs) {
+        const tbody = $('#jobs_queue tbody').empty();
+        let position = 0;
+        jobs.forEach(function (job) {
+            const row = $('<tr>').addClass('job_' + job.state);
+            const progress = job.slots ? job.done_slots + '/' + job.slots : '-';
+            [job.id, job.name, job.user, job.state, progress,
+             duration(job.remaining), job.eta || '-'].forEach(function (val) {
+                row.append($('<td>').text(val));
+            });
+            const buttons = $('<td>');
+            if (job.state === 'queued') {
+                if (position > 0) {
+                    buttons.append($('<button class="btn btn-sm btn-light">')
+                        .append('<i class="lni lni-arrow-up"></i>')
+                        .click(function () {
+                            action('POST', '/jobs/' + job.id + '/move?position=0');
+                        }));
+                }
+                position++;
+            }
+            if (job.state !== 'processing') {
+                buttons.append($('<button class="btn btn-sm btn-light">')
+                    .append('<i class="lni lni-close"></i>')
+                    .click(function () {
+                        action('DELETE', '/jobs/' + job.id);
+                    }));
+            }
+            tbody.append(row.append(buttons));
+        });
+    }
+
+    function refresh() {
+        return fetch('/jobs', { cache: 'no-cache' })
+            .then(function (response) { return response.json(); })
+            .then(function (data) { render(data.jobs); })
+            .catch(function () { });
+    }
+
+    refresh();
+    setInterval(refresh, interval);
+})();
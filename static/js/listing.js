@@ -0,0 +1,123 @@
+/**
+ * Experiments listing with virtual scrolling: only the visible rows are in
+ * the page, they are fetched from /listing one page at a time.
+ * Pages are revalidated by the browser with their ETag (cache: 'no-cache')
+ */
+(function () {
+    const rowHeight = 36;
+    const pageSize = 200;
+    const view = document.getElementById('listing');
+    const spacer = document.getElementById('listing_spacer');
+    const rows = document.getElementById('listing_rows');
+    const state = { path: '', sort: 'name', order: 'asc', total: 0, pages: new Map() };
+
+    function encodePath(path) {
+        return path.split('/').map(encodeURIComponent).join('/');
+    }
+
+    function prettySize(bytes) {
+        if (bytes < 0) {
+            return '—';
+        }
+        const units = [' bytes', ' KB', ' MB', ' GB', ' TB'];
+        let idx = 0;
+        while (bytes >= 1024 && idx < units.length - 1) {
+            bytes /= 1024;
+            idx++;
+        }
+        return Math.floor(bytes) + units[idx];
+    }
+
+    function load(page) {
+        if (!state.pages.has(page)) {
+            const url = '/listing/' + encodePath(state.path) +
+                '?sort=' + state.sort + '&order=' + state.order +
+                '&offset=' + page * pageSize + '&limit=' + pageSize;
+            const request = fetch(url, { cache: 'no-cache' })
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    state.total = data.total;
+                    spacer.style.height = (data.total * rowHeight) + 'px';
+                    $('#listing_desc').text(data.desc ? ' - ' + data.desc : '');
+                    return data.rows;
+                });
+            state.pages.set(page, request);
+        }
+        return state.pages.get(page);
+    }
+
+    function rowElement(row) {
+        const [name, type, size, mtime] = row;
+        const isDir = type.startsWith('folder');
+        const href = isDir ? '#' + (state.path ? state.path + '/' : '') + name
+            : '/experiments/' + encodePath((state.path ? state.path + '/' : '') + name);
+        const elem = $('<div class="listing_row">');
+        elem.append($('<i>').addClass(isDir ? 'lni lni-folder' : 'lni lni-files'));
+        const link = $('<a>').attr('href', href).text(name);
+        if (!isDir) {
+            link.attr('target', '_blank');
+        }
+        elem.append(link);
+        elem.append($('<span>').text(prettySize(size)));
+        elem.append($('<span>').text(mtime === null ? '-' : new Date(mtime * 1000).toLocaleString()));
+        return elem;
+    }
+
+    function render() {
+        const first = Math.floor(view.scrollTop / rowHeight);
+        const count = Math.ceil(view.clientHeight / rowHeight) + 1;
+        const pages = [Math.floor(first / pageSize), Math.floor((first + count) / pageSize)];
+        const path = state.path;
+        Promise.all(pages.map(load)).then(function (loaded) {
+            // the user moved to another dir while loading
+            if (path !== state.path) {
+                return;
+            }
+            const visible = [].concat(loaded[0], pages[1] !== pages[0] ? loaded[1] : [])
+                .slice(first - pages[0] * pageSize, first - pages[0] * pageSize + count);
+            rows.style.transform = 'translateY(' + (first * rowHeight) + 'px)';
+            $(rows).empty().append(visible.map(rowElement));
+        });
+    }
+
+    function breadcrumb() {
+        const elem = $('#listing_path').empty();
+        elem.append($('<a href="#">').text('experiments'));
+        let path = '';
+        state.path.split('/').filter(Boolean).forEach(function (name) {
+            path += (path ? '/' : '') + name;
+            elem.append(' / ', $('<a>').attr('href', '#' + path).text(name));
+        });
+    }
+
+    function open() {
+        state.path = decodeURIComponent(location.hash.slice(1));
+        state.pages.clear();
+        view.scrollTop = 0;
+        breadcrumb();
+        render();
+    }
+
+    $('.listing_head a').click(function (event) {
+        event.preventDefault();
+        const sort = $(this).data('sort');
+        state.order = (state.sort === sort && state.order === 'asc') ? 'desc' : 'asc';
+        state.sort = sort;
+        state.pages.clear();
+        render();
+    });
+
+    // rows of a page are drawn at most once per animation frame
+    let pending = false;
+    view.addEventListener('scroll', function () {
+        if (!pending) {
+            pending = true;
+            requestAnimationFrame(function () {
+                pending = false;
+                render();
+            });
+        }
+    });
+    window.addEventListener('hashchange', open);
+    open();
+})();
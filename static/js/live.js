@@ -0,0 +1,33 @@
+/**
+ * Live readings of the running experiment via websocket (see livestream.py)
+ */
+(function live() {
+    const maxRows = 50;
+    const scheme = (location.protocol === 'https:') ? 'wss://' : 'ws://';
+    const ws = new WebSocket(scheme + location.host + '/ws');
+
+    function fmt(stats) {
+        if (stats.mean === null) {
+            return '-';
+        }
+        return stats.mean.toPrecision(6) + ' ± ' + stats.std.toPrecision(2);
+    }
+
+    ws.onmessage = function (event) {
+        const tbody = $('#live_readings tbody');
+        JSON.parse(event.data).forEach(function (slot) {
+            const row = $('<tr>');
+            [slot.cycle + 1, slot.valve, slot.sensor, slot.samples,
+             fmt(slot.primary), fmt(slot.secondary)].forEach(function (val) {
+                row.append($('<td>').text(val));
+            });
+            tbody.prepend(row);
+        });
+        tbody.children().slice(maxRows).remove();
+    };
+
+    // reconnect if the server restarts or drops us for being too slow
+    ws.onclose = function () {
+        setTimeout(live, 5 * 1000);
+    };
+})();
@@ -1,27 +1,36 @@
 /**
- * Update logs via ajax in a defined interval
+ * Tail the devices log via ajax: the server answers (long poll) with the
+ * entries appended since our cursor, or with the recent history (reset)
  */
-(function poll() {
-    setTimeout(function () {
-        $.ajax({
-            method: 'POST',
-            url: '/ajax',
-            dataType: "json",
-            contentType: "application/json; charset=utf-8",
-            data: JSON.stringify({ 'fname': 'devices.log' }),
-            success: function (data, textStatus, jqXHR) {
-                if (data.contents === "undefined" || data.contents == false) {
-                    return;
-                }
-                elem = $('#devices_log');
+(function poll(cursor) {
+    $.ajax({
+        method: 'POST',
+        url: '/ajax',
+        dataType: "json",
+        contentType: "application/json; charset=utf-8",
+        data: JSON.stringify({ 'fname': 'devices.log', 'cursor': cursor, 'wait': 25 }),
+        success: function (data, textStatus, jqXHR) {
+            if (data.contents === undefined) {
+                return;
+            }
+            cursor = data.cursor;
+            elem = $('#devices_log');
+            if (data.reset) {
                 elem.html(data.contents);
-                elem.scrollTop(elem[0].scrollHeight);
-            },
-            /* call poll again only if server responded last call
-               avoids a bunch of queued Ajax requests in case of
-               server not responding.
-            */
-            complete: poll
-        });
-    }, 3 * 1000); // set polling interval (seconds*1000 = microseconds)
-})();
\ No newline at end of file
+            } else if (data.contents) {
+                elem.append(data.contents);
+            } else {
+                return;
+            }
+            elem.scrollTop(elem[0].scrollHeight);
+        },
+        /* call poll again only if server responded last call
+           avoids a bunch of queued Ajax requests in case of
+           server not responding (wait a bit after errors).
+        */
+        complete: function (jqXHR, textStatus) {
+            setTimeout(function () { poll(cursor); },
+                (textStatus === 'success') ? 0 : 3 * 1000);
+        }
+    });
+})(null);
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 by bgeneto <b g e n e t o @ g m a i l . c o m>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+__doc__ = """
+Crash-safe persistence of the readings while an experiment runs.
+
+Every slot (one sensor read window) is appended to a json lines file in
+the experiment directory as soon as it is read, the file is fsync'd in
+batches. If the experiment crashes or is cancelled, everything read up
+to the last fsync is still on disk:
+
+    writer = ReadingsWriter(output_dir)
+    run_experiment(lcr, arduinos, ..., writer=writer)
+    writer.close()
+    data = load_results(output_dir)
+
+At the end of the experiment the readings file is converted to a compact
+columnar store (see write_columnar) that can be memory-mapped, so a single
+sensor series can be read without loading the rest:
+
+    results = ColumnarResults(output_dir)
+    primary = results.series('V0', 'S1', 'primary')
+
+Old experiments can be migrated from their results.json files with:
+
+    python3 storage.py experiments/
+
+Classes:
+
+    ReadingsWriter
+    ColumnarResults
+
+Functions:
+
+    read_stream(path)
+    write_columnar(output_dir, remove_stream=False)
+    convert_results_json(path)
+    load_results(output_dir)
+    open_results(output_dir)
+
+Misc variables:
+
+    __version__
+    __author__
+"""
+
+import argparse
+import functools
+import json
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import numpy as np
+
+import clocks
+
+__author__ = "bgeneto"
+__copyright__ = "Copyright 2022, bgeneto"
+__credits__ = ["bgeneto"]
+__license__ = "GPL"
+__maintainer__ = "Bernhard Enders"
+__email__ = "b g e n e t o @ d u c k . c o m"
+__version__ = "1.0.0"
+__modified__ = "20261016"
+
+STREAM_FILE = 'readings.jsonl'
+RESULTS_DIR = 'results'
+MANIFEST_FILE = 'manifest.json'
+COLUMNAR_VERSION = 1
+# one row per slot: where its samples are in the primary/secondary columns
+SLOT_DTYPE = np.dtype([('cycle', '<i4'), ('valve', '<i4'), ('sensor', '<i4'),
+                       ('loop', '<i4'), ('time', '<f8'), ('dwell', '<f8'),
+                       ('offset', '<i8'), ('count', '<i8')])
+PARAMS = ('primary', 'secondary')
+
+
+class ReadingsWriter:
+    '''Append-only writer of slot readings (one json record per line).
+       Records are flushed as they are written and fsync'd at most every
+       fsync_interval seconds (zero means after every record).
+       Every record is also passed to the listeners callables'''
+
+    def __init__(self, output_dir, fsync_interval=5.0, listeners=None):
+        self.path = os.path.join(output_dir, STREAM_FILE)
+        self.fsync_interval = fsync_interval
+        self.listeners = [] if listeners is None else list(listeners)
+        self.records = 0
+        self._cycle = 0
+        self._valve = None
+        # sensor loop number of each (cycle, valve, sensor) slot
+        self._loops = {}
+        self._last_sync = clocks.monotonic()
+        self._file = open(self.path, 'a', encoding='UTF-8')
+
+    @classmethod
+    def from_config(cls, cfg, output_dir, listeners=None):
+        fsync_interval = float(cfg.get_setting(
+            "acquisition", "fsync_interval", fallback=5.0))
+
+        return cls(output_dir, fsync_interval, listeners)
+
+    def start_valve(self, cycle, valve):
+        '''the following records belong to this valve cycle and valve'''
+        self._cycle = cycle
+        self._valve = valve
+
+    def write(self, sensor, primary, secondary, dwell):
+        '''append the readings (numpy arrays) of a single slot'''
+        key = (self._cycle, self._valve, sensor)
+        loop = self._loops.get(key, 0)
+        self._loops[key] = loop + 1
+        record = dict(cycle=self._cycle, valve=self._valve, sensor=sensor,
+                      loop=loop, time=clocks.time(), dwell=dwell,
+                      primary=primary.tolist(), secondary=secondary.tolist())
+        # a single write per record, a crash leaves at most one partial line
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self.records += 1
+        if clocks.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+        for listener in self.listeners:
+            listener(record)
+
+    def sync(self):
+        '''force the records written so far to disk'''
+        os.fsync(self._file.fileno())
+        self._last_sync = clocks.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_stream(path):
+    '''yield the records of a readings file, a truncated last line
+       (crash while writing) is skipped'''
+    with open(path, encoding='UTF-8') as infile:
+        for line in infile:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class ColumnarResults:
+    '''Read-only, memory-mapped access to an experiment columnar store:
+
+           results/manifest.json  valve and sensor names, counts, source
+           results/slots.npy      slot index (see SLOT_DTYPE)
+           results/primary.npy    all primary samples, slot after slot
+           results/secondary.npy  all secondary samples, slot after slot
+    '''
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, RESULTS_DIR)
+        with open(os.path.join(self.path, MANIFEST_FILE), encoding='UTF-8') as infile:
+            self.manifest = json.load(infile)
+        self.valves = self.manifest['valves']
+        self.sensors = self.manifest['sensors']
+        self.slots = np.load(os.path.join(self.path, 'slots.npy'))
+        self.columns = {param: np.load(os.path.join(self.path, f'{param}.npy'),
+                                       mmap_mode='r')
+                        for param in PARAMS}
+
+    def select(self, valve=None, sensor=None, cycle=None, cycles=None, loops=None):
+        '''slots (in acquisition order) of the given valve, sensor and cycle,
+           or cycles and loops ranges (e.g. range(2, 4)). Unknown valve or
+           sensor names raise ValueError'''
+        mask = np.ones(len(self.slots), dtype=bool)
+        if valve is not None:
+            mask &= self.slots['valve'] == self.valves.index(valve)
+        if sensor is not None:
+            mask &= self.slots['sensor'] == self.sensors.index(sensor)
+        if cycle is not None:
+            mask &= self.slots['cycle'] == cycle
+        for field, span in (('cycle', cycles), ('loop', loops)):
+            if span is not None:
+                mask &= (self.slots[field] >= span.start) & (self.slots[field] < span.stop)
+        return self.slots[mask]
+
+    def samples(self, slot, param='primary'):
+        '''samples of a single slot (a view of the mapped column)'''
+        return self.columns[param][slot['offset']:slot['offset'] + slot['count']]
+
+    def concat(self, slots, param='primary', step=1):
+        '''samples of the slots (every step-th of each slot), concatenated.
+           Only the selected parts of the mapped column are read'''
+        if len(slots) == 0:
+            return np.empty(0)
+        return np.concatenate([self.samples(slot, param)[::step] for slot in slots])
+
+    def series(self, valve, sensor, param='primary', cycle=None):
+        '''all samples of a sensor, concatenated in acquisition order'''
+        return self.concat(self.select(valve, sensor, cycle), param)
+
+    def to_nested(self):
+        '''the run_experiment data layout (see load_results)'''
+        data = []
+        for slot in self.slots:
+            while len(data) <= slot['cycle']:
+                data.append({})
+            sensors = data[slot['cycle']].setdefault(self.valves[slot['valve']], {})
+            sensor = sensors.setdefault(self.sensors[slot['sensor']],
+                                        {'primary': [], 'secondary': [], 'dwell': []})
+            sensor['dwell'].append(float(slot['dwell']))
+            for param in PARAMS:
+                sensor[param].extend(self.samples(slot, param).tolist())
+
+        return data
+
+
+@functools.lru_cache(maxsize=16)
+def _open_results(output_dir, mtime):
+    return ColumnarResults(output_dir)
+
+
+def open_results(output_dir):
+    '''ColumnarResults of output_dir, kept open (up to 16 experiments) and
+       reopened if the store is rewritten'''
+    manifest = os.path.join(output_dir, RESULTS_DIR, MANIFEST_FILE)
+    return _open_results(output_dir, os.stat(manifest).st_mtime_ns)
+
+
+def _write_columnar(results_dir, records, source):
+    '''write the store from records (a callable returning an iterator over
+       slot records, called twice so the samples never are all in memory)'''
+    valves, sensors, slots = [], [], []
+    offset = 0
+    # first pass: slot index
+    for record in records():
+        for names, name in ((valves, record['valve']), (sensors, record['sensor'])):
+            if name not in names:
+                names.append(name)
+        count = len(record['primary'])
+        slots.append((record['cycle'], valves.index(record['valve']),
+                      sensors.index(record['sensor']), record['loop'],
+                      record['time'], record['dwell'], offset, count))
+        offset += count
+    index = np.array(slots, dtype=SLOT_DTYPE)
+
+    # write to a temporary directory, replace the old store when complete
+    tmp_dir = results_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'slots.npy'), index)
+    columns = {param: np.lib.format.open_memmap(
+        os.path.join(tmp_dir, f'{param}.npy'), mode='w+', dtype='<f8',
+        shape=(offset,)) for param in PARAMS}
+    # second pass: samples
+    for slot, record in zip(index, records()):
+        for param in PARAMS:
+            columns[param][slot['offset']:slot['offset'] + slot['count']] = \
+                record[param][:slot['count']]
+    for column in columns.values():
+        column.flush()
+    del columns
+
+    manifest = dict(version=COLUMNAR_VERSION,
+                    created=datetime.now().isoformat(timespec='seconds'),
+                    source=source,
+                    valves=valves,
+                    sensors=sensors,
+                    slots=len(index),
+                    samples=offset,
+                    columns=list(PARAMS),
+                    slot_fields=list(SLOT_DTYPE.names))
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='UTF-8') as outfile:
+        json.dump(manifest, outfile, indent=2)
+    shutil.rmtree(results_dir, ignore_errors=True)
+    os.replace(tmp_dir, results_dir)
+
+
+def write_columnar(output_dir, remove_stream=False):
+    '''convert the readings file of an experiment to the columnar store'''
+    stream = os.path.join(output_dir, STREAM_FILE)
+    _write_columnar(os.path.join(output_dir, RESULTS_DIR),
+                    lambda: read_stream(stream), STREAM_FILE)
+    if remove_stream:
+        os.remove(stream)
+
+
+def convert_results_json(path):
+    '''migrate an old results.json file to the columnar store (in the same
+       directory). Old files do not keep the sensor loops apart nor
+       timestamps, so every valve/sensor pair becomes a single slot'''
+    with open(path, encoding='ISO-8859-1') as infile:
+        data = json.load(infile)
+
+    def records():
+        for cycle, valves in enumerate(data):
+            for valve, sensors in valves.items():
+                for sensor, readings in sensors.items():
+                    count = min(len(readings['primary']),
+                                len(readings['secondary']))
+                    dwell = readings.get('dwell')
+                    yield dict(cycle=cycle, valve=valve, sensor=sensor, loop=0,
+                               time=np.nan,
+                               dwell=sum(dwell) if dwell else np.nan,
+                               primary=readings['primary'][:count],
+                               secondary=readings['secondary'][:count])
+
+    output_dir = os.path.dirname(os.path.abspath(path))
+    _write_columnar(os.path.join(output_dir, RESULTS_DIR), records,
+                    os.path.basename(path))
+
+    return output_dir
+
+
+def load_results(output_dir):
+    '''rebuild the run_experiment data layout from the columnar store, or
+       from the readings file if the experiment was not converted yet:
+       a list (valve cycles) of dicts valve -> sensor -> primary,
+       secondary and dwell lists'''
+    if os.path.exists(os.path.join(output_dir, RESULTS_DIR, MANIFEST_FILE)):
+        return ColumnarResults(output_dir).to_nested()
+
+    data = []
+    for record in read_stream(os.path.join(output_dir, STREAM_FILE)):
+        while len(data) <= record['cycle']:
+            data.append({})
+        sensors = data[record['cycle']].setdefault(record['valve'], {})
+        sensor = sensors.setdefault(
+            record['sensor'], {'primary': [], 'secondary': [], 'dwell': []})
+        sensor['dwell'].append(record['dwell'])
+        sensor['primary'].extend(record['primary'])
+        sensor['secondary'].extend(record['secondary'])
+
+    return data
+
+
+def add_args():
+    parser = argparse.ArgumentParser(
+        description='Convert old results.json files to the columnar results store.')
+    parser.add_argument('paths', nargs='+',
+                        help='results.json files or directories to search (recursively)')
+    parser.add_argument('--remove', action='store_true',
+                        help='remove results.json after a successful conversion')
+
+    return parser
+
+
+def main(argv):
+    opts = add_args().parse_args(argv)
+    files = []
+    for path in opts.paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                if 'results.json' in names:
+                    files.append(os.path.join(root, 'results.json'))
+        else:
+            files.append(path)
+
+    for path in sorted(files):
+        try:
+            output_dir = convert_results_json(path)
+        except (OSError, ValueError, KeyError) as exc:
+            print(f'ERROR: unable to convert {path}: {exc}')
+            continue
+        if opts.remove:
+            os.remove(path)
+        print(f'Converted {path} -> {os.path.join(output_dir, RESULTS_DIR)}')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import mycfg
+
+
+class StaleIpTest(unittest.TestCase):
+    '''the [web] ip of config.ini is refreshed when the host address changes'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cfg_file = os.path.join(self.tmpdir.name, 'config.ini')
+        with open(self.cfg_file, 'w', encoding='UTF-8') as f:
+            f.write('[web]\nport = 8080\nip = 10.9.9.9\n\n'
+                    '[experiment]\nvalves_loop = 4\n')
+        patcher = mock.patch.object(mycfg, 'get_ip', return_value='192.168.0.7')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_get_setting_with_stale_ip(self):
+        cfg = mycfg.MyConfig(self.cfg_file)
+        self.assertEqual(cfg.get_int('web', 'port'), 8080)
+        self.assertEqual(cfg.get_setting('web', 'ip'), '192.168.0.7')
+        self.assertEqual(cfg.get_int('experiment', 'valves_loop'), 4)
+        # the refreshed ip is saved
+        self.assertIn('ip = 192.168.0.7', open(self.cfg_file).read())
+
+    def test_update_stale_ip(self):
+        cfg = mycfg.MyConfig(self.cfg_file)
+        cfg.update({'web': {'ip': '10.9.9.9'}})
+        self.assertEqual(cfg.get_setting('web', 'ip'), '192.168.0.7')
+        self.assertEqual(cfg.get_int('web', 'port'), 8080)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,24 +23,31 @@ Author:   b g e n e t o @ g m a i l . c o m
 
 """
 
+import asyncio
+import functools
 import json
+import mimetypes
 import os
+import re
 import sys
+import time
+import zlib
 from datetime import date
 
-import pandas as pd
-import plotly
-import plotly.express as px
 import tornado.autoreload
-import tornado.concurrent
 import tornado.gen
 import tornado.httpserver
 import tornado.ioloop
 import tornado.web
 import tornado.websocket
 
+import catalog as catalogdb
+import exporter
 import indexer
+import jobs
+import livestream
 import mycfg
+import storage
 from devices import *
 
 __author__ = "Bernhard Enders"
@@ -55,6 +62,18 @@ __year__ = date.today().year
 
 # global variables
 BASE_EXP_DIR = 'experiments'
+# log tailing: history sent at once, long poll limit and check interval
+LOG_TAIL_BYTES = 256*1024
+LOG_MAX_WAIT = 30
+LOG_POLL_INTERVAL = 0.25
+# rows of an experiments listing sent by default and at most
+LISTING_PAGE = 100
+LISTING_MAX_PAGE = 1000
+# samples sent at most by a single data request (binary and json format)
+DATA_MAX_SAMPLES = 1000000
+DATA_MAX_JSON_SAMPLES = 100000
+# devices connected by the job queue worker (see connect_devices)
+devices = {}
 
 
 class IndexHandler(tornado.web.RequestHandler):
@@ -72,38 +91,74 @@ class PageHandler(tornado.web.RequestHandler):
         params['__version__'] = __version__
         params['__year__'] = __year__
         params['page_id'] = int(id)
-        params['valves_loop'] = int(cfg.get_setting(
-            "experiment", "valves_loop"))
-        params['sensors_loop'] = int(cfg.get_setting(
-            "experiment", "sensors_loop"))
-        params['sensors_duration'] = int(cfg.get_setting(
-            "experiment", "sensors_duration"))
-        params['a1_sensors'] = ['']*8
-        params['a1_valves'] = ['']*8
-        params['a2_sensors'] = ['']*8
-        params['a2_valves'] = ['']*8
-        params['a1_sensors'] = str(cfg.get_setting(
-            "arduino1", "sensors")).split(";")
-        params['a1_valves'] = str(cfg.get_setting(
-            "arduino1", "valves")).split(";")
-        params['a1_model'] = str(cfg.get_setting(
-            "arduino1", "model"))
-        params['a1_onoff'] = str(cfg.get_setting(
-            "arduino1", "invert_onoff"))
-        params['a2_sensors'] = str(cfg.get_setting(
-            "arduino2", "sensors")).split(";")
-        params['a2_valves'] = str(cfg.get_setting(
-            "arduino2", "valves")).split(";")
-        params['a2_model'] = str(cfg.get_setting(
-            "arduino2", "model"))
-        params['a2_onoff'] = str(cfg.get_setting(
-            "arduino2", "invert_onoff"))
+        params['valves_loop'] = cfg.get_int("experiment", "valves_loop")
+        params['sensors_loop'] = cfg.get_int("experiment", "sensors_loop")
+        params['sensors_duration'] = cfg.get_int(
+            "experiment", "sensors_duration")
+        params['a1_sensors'] = cfg.get_list("arduino1", "sensors")
+        params['a1_valves'] = cfg.get_list("arduino1", "valves")
+        params['a1_model'] = str(cfg.get_setting("arduino1", "model"))
+        params['a1_onoff'] = str(cfg.get_setting("arduino1", "invert_onoff"))
+        params['a2_sensors'] = cfg.get_list("arduino2", "sensors")
+        params['a2_valves'] = cfg.get_list("arduino2", "valves")
+        params['a2_model'] = str(cfg.get_setting("arduino2", "model"))
+        params['a2_onoff'] = str(cfg.get_setting("arduino2", "invert_onoff"))
         # finally render the page with the parameters
         self.render(f'page{id}.html', **params)
 
 
+def _entry_end(chunk):
+    '''end of the last complete log entry (line or html paragraph)'''
+    end = chunk.rfind(b'\n') + 1
+    para = chunk.rfind(b'</p>')
+    if para >= 0:
+        end = max(end, para + 4)
+    return end
+
+
+def tail_log(fname, cursor=None, max_bytes=LOG_TAIL_BYTES):
+    '''complete log entries appended to fname after cursor (an opaque
+       "inode:offset" string). Without a valid cursor, or if more than
+       max_bytes were appended, only the last max_bytes are returned and
+       reset is True (the client must replace what it has).
+       Returns (contents, cursor, reset)'''
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return '', None, cursor is not None
+    try:
+        inode, offset = (int(val) for val in cursor.split(':'))
+    except (AttributeError, ValueError):
+        inode, offset = None, -1
+    # the log was recreated (new experiment) or truncated
+    reset = inode != st.st_ino or not 0 <= offset <= st.st_size
+    if reset or st.st_size - offset > max_bytes:
+        reset = True
+        offset = max(0, st.st_size - max_bytes)
+    with open(fname, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read(st.st_size - offset)
+    # start at an entry boundary when skipping history
+    if reset and offset > 0:
+        skip = len(chunk)
+        for sep in (b'\n', b'</p>'):
+            pos = chunk.find(sep)
+            if pos >= 0:
+                skip = min(skip, pos + len(sep))
+        chunk = chunk[skip:]
+        offset += skip
+    end = _entry_end(chunk)
+    cursor = f'{st.st_ino}:{offset + end}'
+
+    return chunk[:end].decode('UTF-8', errors='replace'), cursor, reset
+
+
 class AjaxHandler(tornado.web.RequestHandler):
-    def post(self):
+    '''Log tailing: {"fname": "devices.log", "cursor": ..., "wait": secs}
+       returns the entries appended since cursor (see tail_log), waiting
+       up to wait seconds (long poll) for new entries'''
+
+    async def post(self):
         try:
             data = json.loads(self.request.body)
         except:
@@ -111,16 +166,29 @@ class AjaxHandler(tornado.web.RequestHandler):
             self.finish()
             return
 
-        # check if log file exists
-        log = ''
-        if os.path.isfile(data['fname']):
-            with open(data['fname'], 'r', encoding='UTF-8') as f:
-                log = f.read()
+        # only log files of the working directory
+        fname = os.path.basename(str(data.get('fname', '')))
+        if not fname.endswith('.log'):
+            raise tornado.web.HTTPError(403)
+        try:
+            wait = min(float(data.get('wait', 0)), LOG_MAX_WAIT)
+        except (TypeError, ValueError):
+            wait = 0
+        cursor = data.get('cursor')
+        deadline = time.monotonic() + wait
+        log, new_cursor, reset = tail_log(fname, cursor)
+        while not log and not reset and time.monotonic() < deadline:
+            if self.request.connection.stream.closed():
+                return
+            await asyncio.sleep(LOG_POLL_INTERVAL)
+            log, new_cursor, reset = tail_log(fname, cursor)
 
         # json response
         response_to_send = {}
         response_to_send['status'] = 'ok'
         response_to_send['contents'] = log
+        response_to_send['cursor'] = new_cursor
+        response_to_send['reset'] = reset
         self.write(json.dumps(response_to_send))
         self.finish()
         return
@@ -128,9 +196,269 @@ class AjaxHandler(tornado.web.RequestHandler):
     get = post
 
 
-class FormHandler(tornado.web.RequestHandler):
+class CatalogHandler(tornado.web.RequestHandler):
+    '''Experiments catalog queries (see catalog.py):
+       /catalog?user=&since=&until=&sensor=&q=&offset=&limit= newest first
+       /catalog/<experiment path> slot statistics of an experiment'''
+
+    def get(self, path):
+        if path:
+            slots = catalog.slots(path)
+            if not slots:
+                raise tornado.web.HTTPError(404)
+            self.write({'path': path, 'slots': slots})
+            return
+        try:
+            total, experiments = catalog.search(
+                user=self.get_argument('user', None),
+                since=self.get_argument('since', None),
+                until=self.get_argument('until', None),
+                sensor=self.get_argument('sensor', None),
+                text=self.get_argument('q', None),
+                offset=max(0, int(self.get_argument('offset', 0))),
+                limit=min(max(0, int(self.get_argument('limit', LISTING_PAGE))),
+                          LISTING_MAX_PAGE))
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        self.write({'total': total, 'experiments': experiments})
+
+
+def _span(text):
+    '''a loop or cycle range: "3" or "2-5" (inclusive), None if empty'''
+    if not text:
+        return None
+    first, _, last = text.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+
+class DataHandler(tornado.web.RequestHandler):
+    '''Samples of one sensor of an experiment (catalog id or path), only
+       the requested slots are read from the columnar store:
+       /data/<experiment>?valve=V0&sensor=S1&param=primary|secondary
+           &cycles=0-2&loops=3&step=|points=&format=json|bin
+       The bin format is the float64 (little-endian) samples, with the
+       samples per slot in the X-Slot-Counts header'''
+
+    def initialize(self, path):
+        self.root = os.path.abspath(path)
+
+    async def get(self, experiment):
+        if experiment.isdigit():
+            experiment = catalog.experiment_path(int(experiment))
+            if experiment is None:
+                raise tornado.web.HTTPError(404)
+        output_dir = os.path.abspath(os.path.join(self.root, experiment))
+        manifest = os.path.join(output_dir, storage.RESULTS_DIR,
+                                storage.MANIFEST_FILE)
+        if not output_dir.startswith(self.root + os.sep) or \
+                not os.path.isfile(manifest):
+            raise tornado.web.HTTPError(404)
+
+        param = self.get_argument('param', 'primary')
+        fmt = self.get_argument('format', 'json')
+        if param not in storage.PARAMS or fmt not in ('json', 'bin'):
+            raise tornado.web.HTTPError(400)
+
+        # the data only changes if the experiment store is rewritten
+        mtime = os.stat(manifest).st_mtime_ns
+        query = zlib.crc32(self.request.query.encode())
+        self.set_header('Etag', f'"{mtime:x}-{query:x}"')
+        self.set_header('Cache-Control', 'no-cache')
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        results = storage.open_results(output_dir)
+        valve = self.get_argument('valve')
+        sensor = self.get_argument('sensor')
+        if valve not in results.valves or sensor not in results.sensors:
+            raise tornado.web.HTTPError(404)
+        try:
+            cycles = _span(self.get_argument('cycles', None))
+            loops = _span(self.get_argument('loops', None))
+            step = max(1, int(self.get_argument('step', 1)))
+            points = int(self.get_argument('points', 0))
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+
+        # reading and serializing up to a million samples would block the
+        # io loop, it runs in a renderer worker
+        max_samples = DATA_MAX_SAMPLES if fmt == 'bin' else DATA_MAX_JSON_SAMPLES
+        info = dict(experiment=experiment, valve=valve, sensor=sensor, param=param)
+        try:
+            body, step, counts = await asyncio.wrap_future(renderer.data_slice(
+                output_dir, valve, sensor, param, cycles=cycles, loops=loops,
+                step=step, points=points, fmt=fmt, max_samples=max_samples,
+                info=info))
+        except ValueError as exc:
+            hint = '' if fmt == 'bin' else ' or format=bin'
+            raise tornado.web.HTTPError(400, f'{exc}{hint}')
+
+        if fmt == 'bin':
+            self.set_header('Content-Type', 'application/octet-stream')
+            self.set_header('X-Slot-Counts', ','.join(map(str, counts)))
+            self.set_header('X-Step', str(step))
+        else:
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(body)
+
+
+class ListingHandler(tornado.web.RequestHandler):
+    '''JSON listing of an experiments dir, one page of rows at a time:
+       /listing/<dir>?sort=name|size|mtime&order=asc|desc&offset=&limit=
+       Browsers revalidate it with the ETag of the response'''
+
+    def initialize(self, path):
+        self.root = os.path.abspath(path)
+
+    def get(self, path):
+        path_dir = os.path.abspath(os.path.join(self.root, path))
+        if path_dir != self.root and not path_dir.startswith(self.root + os.sep):
+            raise tornado.web.HTTPError(404)
+        if not os.path.isdir(path_dir):
+            raise tornado.web.HTTPError(404)
+        sort = self.get_argument('sort', 'name')
+        order = self.get_argument('order', 'asc')
+        try:
+            offset = max(0, int(self.get_argument('offset', 0)))
+            limit = min(max(0, int(self.get_argument('limit', LISTING_PAGE))),
+                        LISTING_MAX_PAGE)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        if sort not in indexer.SORT_KEYS or order not in ('asc', 'desc'):
+            raise tornado.web.HTTPError(400)
+
+        desc, rows = indexer.list_dir(path_dir, sort, order == 'desc')
+        path = os.path.relpath(path_dir, self.root)
+        # tornado replies 304 if the etag (hash of the body) did not change
+        self.set_header('Cache-Control', 'no-cache')
+        self.write({'path': '' if path == '.' else path.replace(os.sep, '/'),
+                    'desc': desc,
+                    'total': len(rows),
+                    'offset': offset,
+                    'columns': ['name', 'type', 'size', 'mtime'],
+                    'rows': rows[offset:offset + limit]})
+
+
+class StaticHandler(tornado.web.StaticFileHandler):
+    '''Static files. Versioned files (e.g. plotly-2.0.0.min.js) never
+       change and are cached forever, a precompressed file.gz variant is
+       sent instead of file to clients that accept gzip'''
+
+    VERSIONED = re.compile(r'-\d+(\.\d+)+(\.min)?\.(js|css)$')
+
+    def validate_absolute_path(self, root, absolute_path):
+        self.gzipped = False
+        accept = self.request.headers.get('Accept-Encoding', '')
+        if 'gzip' in accept and os.path.isfile(absolute_path + '.gz'):
+            self.gzipped = True
+            absolute_path += '.gz'
+        return super(StaticHandler, self).validate_absolute_path(root, absolute_path)
+
+    def get_content_type(self):
+        if self.gzipped:
+            mime_type, _ = mimetypes.guess_type(self.absolute_path[:-3])
+            return mime_type or 'application/octet-stream'
+        return super(StaticHandler, self).get_content_type()
+
+    def get_cache_time(self, path, modified, mime_type):
+        if self.VERSIONED.search(path):
+            return self.CACHE_MAX_AGE
+        return super(StaticHandler, self).get_cache_time(path, modified, mime_type)
+
+    def set_extra_headers(self, path):
+        self.set_header('Vary', 'Accept-Encoding')
+        if self.gzipped:
+            self.set_header('Content-Encoding', 'gzip')
+        if self.VERSIONED.search(path):
+            self.set_header('Cache-Control',
+                            f'public, max-age={self.CACHE_MAX_AGE}, immutable')
+
+
+class PlotHandler(tornado.web.RequestHandler):
+    '''Plots of the experiments saved in the columnar store, rendered on
+       first request by the PlotRenderer workers and kept in the PlotCache.
+       Older experiments have their plots on disk, they are served as is.
+       The .json variant returns the data of a zoomed range (?x0=&x1=)'''
+
+    def initialize(self, path):
+        self.root = os.path.abspath(path)
+
+    async def get(self, exp_dir, param, name, ext):
+        output_dir = os.path.abspath(os.path.join(self.root, exp_dir))
+        if not output_dir.startswith(self.root + os.sep):
+            raise tornado.web.HTTPError(404)
+        manifest = os.path.join(output_dir, storage.RESULTS_DIR,
+                                storage.MANIFEST_FILE)
+        if ext == 'json':
+            await self.get_data(output_dir, param, name, manifest)
+            return
+        self.set_header('Content-Type', 'text/html; charset=UTF-8')
+        if not os.path.isfile(manifest):
+            fn = os.path.join(output_dir, param, name + '.html')
+            if not os.path.isfile(fn):
+                raise tornado.web.HTTPError(404)
+            with open(fn, 'rb') as f:
+                self.write(f.read())
+            return
+
+        # the plot only changes if the experiment data or the renderer
+        # settings (points, downsampling, plotly.js file) change
+        mtime = os.stat(manifest).st_mtime_ns
+        version = zlib.crc32(repr((mtime, renderer.settings)).encode())
+        self.set_header('Etag', f'"{mtime:x}-{version:x}"')
+        self.set_header('Cache-Control', 'no-cache')
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        key = (output_dir, param, name)
+        html = plot_cache.get(key, (mtime, renderer.settings))
+        if html is None:
+            try:
+                page, _ = await asyncio.wrap_future(
+                    renderer.render(output_dir, param, name))
+            except KeyError:
+                raise tornado.web.HTTPError(404)
+            html = page.encode('UTF-8')
+            plot_cache.put(key, (mtime, renderer.settings), html)
+        self.write(html)
+
+    async def get_data(self, output_dir, param, name, manifest):
+        if not os.path.isfile(manifest):
+            raise tornado.web.HTTPError(404)
+        try:
+            x0 = self.get_argument('x0', None)
+            x1 = self.get_argument('x1', None)
+            x0 = None if x0 is None else float(x0)
+            x1 = None if x1 is None else float(x1)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        try:
+            data = await asyncio.wrap_future(
+                renderer.data(output_dir, param, name, x0, x1))
+        except KeyError:
+            raise tornado.web.HTTPError(404)
+        self.set_header('Cache-Control', 'no-cache')
+        self.write(data)
 
-    _thread_pool = tornado.concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+class LiveHandler(tornado.websocket.WebSocketHandler):
+    '''/ws: live summaries of the slots read by the running experiment
+       (see livestream.py), ?raw=1 adds decimated raw samples'''
+
+    def open(self):
+        broadcaster.register(self, raw=self.get_argument('raw', '0') == '1')
+
+    def on_message(self, message):
+        # viewers only, nothing to receive
+        pass
+
+    def on_close(self):
+        broadcaster.unregister(self)
+
+
+class FormHandler(tornado.web.RequestHandler):
 
     def post(self):
         # every form most have a unique page_id
@@ -147,15 +475,10 @@ class FormHandler(tornado.web.RequestHandler):
                 form_action = str(self.get_body_arguments("form_action")[0])
                 if form_action == "cancel":
                     status = 3
-                    # change watched file to force tornado reload
-                    try:
-                        with open('reload', 'w') as f:
-                            f.write(
-                                'Change this file in order to force a tornado reload!')
-                    except:
-                        pass
+                    # stop the running experiment, its readings are kept
+                    job_queue.cancel()
                 else:
-                    # start a new experiment
+                    # queue a new experiment
                     self.start_experiment()
             elif page_id == 1:
                 self.experiment_config()
@@ -172,9 +495,7 @@ class FormHandler(tornado.web.RequestHandler):
     get = post
 
     def arduino_config(self):
-        config = cfg.get_config()
-        config['arduino1'] = {}
-        config['arduino2'] = {}
+        config = {'arduino1': {}, 'arduino2': {}}
         # write arduino parameters to file
         a1_sensors_lst = []
         a1_valves_lst = []
@@ -209,12 +530,10 @@ class FormHandler(tornado.web.RequestHandler):
         config['arduino2']['sensors'] = ";".join(
             a2_sensors_lst).replace(' ', '')
         config['arduino2']['valves'] = ";".join(a2_valves_lst).replace(' ', '')
-        with open(cfg.cfg_file, 'w', encoding='UTF-8') as configfile:
-            config.write(configfile)
+        cfg.update(config)
 
     def experiment_config(self):
-        config = cfg.get_config()
-        config['experiment'] = {}
+        config = {'experiment': {}}
         # write experiment parameters to file
         valves_loop = str(self.get_body_arguments('valves_loop')[0])
         sensors_loop = str(self.get_body_arguments('sensors_loop')[0])
@@ -222,176 +541,200 @@ class FormHandler(tornado.web.RequestHandler):
         config['experiment']['valves_loop'] = valves_loop
         config['experiment']['sensors_loop'] = sensors_loop
         config['experiment']['sensors_duration'] = sensors_duration
-        with open(cfg.cfg_file, 'w', encoding='UTF-8') as configfile:
-            config.write(configfile)
-
-    def update_output_dir(self):
-        """Update the output directory generating correspoding 'index.html' files"""
-        parser = indexer.add_args()
-        args = parser.parse_args([BASE_EXP_DIR, '--recursive'])
-        indexer.process_dir(args.top_dir, args)
-
-    def write_each_sensor(self, data, output_dir):
-        # convert data to dataframe
-        data_df = pd.json_normalize(data)
-        # write individual csv files for each sensor
-        for valve in data[0].keys():
-            for sensor in data[0][valve].keys():
-                for param in ['primary', 'secondary']:
-                    cname = f'{valve}.{sensor}.{param}'
-                    pseries = data_df[cname].explode(cname)
-                    # rename series
-                    vnum = int(valve[1:]) + 1
-                    snum = int(sensor[1:]) + 1
-                    pseries.rename(f'V{vnum}.S{snum}', inplace=True)
-                    fn = os.path.join(output_dir, param,
-                                      f'V{vnum}-S{snum}')
-                    # write to csv file
-                    pseries.to_csv(fn+'.csv')
-                    # produce plots
-                    fig = px.scatter(pseries)
-                    fig.update_traces(mode='lines+markers')
-                    plotly.offline.plot(fig,
-                                        include_plotlyjs='cdn',
-                                        filename=fn+'.html')
-
-    def write_all_sensors(self, data, output_dir):
-        # convert data to dataframe
-        data_df = pd.json_normalize(data)
-        # new column names
-        cols = {"V0.S0.primary": "V1.S1",
-                "V0.S1.primary": "V1.S2",
-                "V0.S2.primary": "V1.S3",
-                "V0.S3.primary": "V1.S4",
-                "V0.S4.primary": "V1.S5",
-                "V0.S5.primary": "V1.S6",
-                "V0.S6.primary": "V1.S7",
-                "V0.S7.primary": "V1.S8",
-                "V0.S0.secondary": "V1.S1",
-                "V0.S1.secondary": "V1.S2",
-                "V0.S2.secondary": "V1.S3",
-                "V0.S3.secondary": "V1.S4",
-                "V0.S4.secondary": "V1.S5",
-                "V0.S5.secondary": "V1.S6",
-                "V0.S6.secondary": "V1.S7",
-                "V0.S7.secondary": "V1.S8",
-                "V1.S0.primary": "V2.S1",
-                "V1.S1.primary": "V2.S2",
-                "V1.S2.primary": "V2.S3",
-                "V1.S3.primary": "V2.S4",
-                "V1.S4.primary": "V2.S5",
-                "V1.S5.primary": "V2.S6",
-                "V1.S6.primary": "V2.S7",
-                "V1.S7.primary": "V2.S8",
-                "V1.S0.secondary": "V2.S1",
-                "V1.S1.secondary": "V2.S2",
-                "V1.S2.secondary": "V2.S3",
-                "V1.S3.secondary": "V2.S4",
-                "V1.S4.secondary": "V2.S5",
-                "V1.S5.secondary": "V2.S6",
-                "V1.S6.secondary": "V2.S7",
-                "V1.S7.secondary": "V2.S8",
-                }
-        # write all sensors to csv file
-        for valve in data[0].keys():
-            for param in ['primary', 'secondary']:
-                valve_df = data_df.filter(regex=f'{valve}.*{param}').copy()
-                min_rows = sys.maxsize
-                for col in valve_df.columns:
-                    rows = valve_df[col].map(len).min()
-                    min_rows = rows if rows < min_rows else min_rows
-                for idx in valve_df.index:
-                    for col in valve_df.columns:
-                        valve_df.loc[idx, col] = valve_df[col][idx][0:min_rows]
-                valve_df = valve_df.explode(
-                    list(valve_df.columns), ignore_index=True)
-                valve_df.rename(columns=cols, inplace=True)
-                vnum = int(valve[1:]) + 1
-                fn = os.path.join(output_dir, param, f'V{vnum}')
-                # write to csv file
-                valve_df.to_csv(fn+'.csv')
-                # produce plots
-                fig = px.scatter(valve_df)
-                fig.update_traces(mode='lines+markers')
-                plotly.offline.plot(fig,
-                                    include_plotlyjs='cdn',
-                                    filename=fn+'.html')
-
-    @tornado.concurrent.run_on_executor(executor='_thread_pool')
+        cfg.update(config)
+
     def start_experiment(self):
-        global lcr
-        global arduinos
-        '''start a new experiment'''
-        # ensures that this variable is accessible in the other thread
-        cfg = mycfg.MyConfig(CFGFN)
-
-        # experiment parameters
-        params = dict(
-            vloop=int(cfg.get_setting("experiment", "valves_loop")),
-            sloop=int(cfg.get_setting("experiment", "sensors_loop")),
-            stime=int(cfg.get_setting("experiment", "sensors_duration"))
-        )
-
-        # configure and connect all required arduinos
-        arduinos = arduinos_connect(cfg)
-
-        # LCR TH2816B serial connection
+        '''queue a new experiment (see run_job)'''
+        exp_name = str(self.get_body_arguments('exp_name')[0])
+        username = str(self.get_body_arguments('username')[0])
+        submit_experiment(exp_name, username)
+
+
+class JobsHandler(tornado.web.RequestHandler):
+    '''Experiments queue (see jobs.py):
+       GET    /jobs                  jobs with state, remaining secs and eta
+       POST   /jobs                  queue an experiment (name, username)
+       POST   /jobs/<id>/move?position=N  reorder a queued job (0 is next)
+       POST   /jobs/<id>/cancel      stop the running job
+       DELETE /jobs/<id>             remove a job (cancel it if running)'''
+
+    def get(self, job_id, action):
+        if job_id or action:
+            raise tornado.web.HTTPError(405)
+        self.set_header('Cache-Control', 'no-cache')
+        self.write({'jobs': job_queue.status()})
+
+    def post(self, job_id, action):
+        if not job_id:
+            job = submit_experiment(self.get_argument('name', ''),
+                                    self.get_argument('username', ''))
+            self.set_status(201)
+            self.write(job.to_dict())
+            return
+        if job_queue.get(int(job_id)) is None:
+            raise tornado.web.HTTPError(404)
+        if action == 'move':
+            try:
+                position = int(self.get_argument('position'))
+            except ValueError:
+                raise tornado.web.HTTPError(400)
+            done = job_queue.move(int(job_id), position)
+        elif action == 'cancel':
+            done = job_queue.cancel(int(job_id))
+        else:
+            raise tornado.web.HTTPError(405)
+        if not done:
+            raise tornado.web.HTTPError(409)
+        self.write({'jobs': job_queue.status()})
+
+    def delete(self, job_id, action):
+        if not job_id or action:
+            raise tornado.web.HTTPError(405)
+        if job_queue.get(int(job_id)) is None:
+            raise tornado.web.HTTPError(404)
+        if not job_queue.remove(int(job_id)):
+            raise tornado.web.HTTPError(409)
+        self.write({'jobs': job_queue.status()})
+
+
+def submit_experiment(exp_name, username):
+    '''queue an experiment with the current experiment settings, its
+       duration is estimated from the valves and sensors configured'''
+    if len(exp_name) < 1:
+        exp_name = 'No desc'
+    params = dict(valves_loop=cfg.get_int("experiment", "valves_loop"),
+                  sensors_loop=cfg.get_int("experiment", "sensors_loop"),
+                  sensors_duration=cfg.get_int("experiment", "sensors_duration"))
+    pins = {kind: sum(1 for device in ('arduino1', 'arduino2')
+                      for pin in cfg.get_list(device, kind, fallback='') if pin)
+            for kind in ('valves', 'sensors')}
+    slots = params['valves_loop'] * pins['valves'] * \
+        params['sensors_loop'] * pins['sensors']
+    slot_secs = params['sensors_duration'] + \
+        cfg.get_float("acquisition", "settle_time", fallback=0.5)
+    job = job_queue.submit(exp_name, username, params, slots, slots * slot_secs)
+    cprint.info(f'Experiment {job.id} queued: {exp_name}')
+
+    return job
+
+
+def run_job(job):
+    '''acquisition of a queued experiment, run by the job_queue worker.
+       Returns the post-processing of the results (see finish_experiment)'''
+    # experiment parameters (settings at submit time)
+    params = dict(
+        vloop=job.params['valves_loop'],
+        sloop=job.params['sensors_loop'],
+        stime=job.params['sensors_duration'],
+        settle=cfg.get_float("acquisition", "settle_time", fallback=0.5),
+        dwell=Dwell.from_config(cfg),
+        valve_settle=cfg.get_float(
+            "acquisition", "valve_settle", fallback=0.0),
+        scheduler=PipelinedScheduler.from_config(cfg)
+    )
+
+    # arduinos and LCR TH2816B, still connected after the previous job.
+    # Connected first, a failure leaves no empty experiment dir behind
+    lcr, arduinos, reused = connect_devices()
+
+    # subdirectories to create
+    topdir = job.user if len(job.user) > 0 else None
+    subdirs = ['primary', 'secondary']
+
+    # create output directory and subdirectories before the experiment
+    # starts, readings are streamed there while they are acquired
+    output_dir = create_output_dir(topdir, subdirs)
+    job.output_dir = output_dir
+    with open(os.path.join(output_dir, 'desc.txt'), 'w', encoding='UTF-8') as fp:
+        fp.write(job.name)
+
+    # run the experiment, job.progress stops it when cancelled
+    writer = storage.ReadingsWriter.from_config(
+        cfg, output_dir, listeners=[broadcaster.publish, job.progress])
+    ended = False
+    try:
+        if not job.cancelled.is_set():
+            run_experiment(lcr, arduinos, writer=writer,
+                           warmup=0 if reused else 1, **params)
+        ended = True
+    except jobs.JobCancelled:
+        cprint.warn(f'Experiment {job.id} cancelled')
+        ended = True
+    except Exception as exp:
+        print(traceback.format_exc())
+        job.error = str(exp)
+    finally:
+        writer.close()
+        if ended:
+            # valves and sensors off, the next job reuses the connections
+            switch_off(arduinos)
+        else:
+            # unknown devices state, the next job connects again
+            release_devices()
+
+    return functools.partial(finish_experiment, output_dir, job.user, job.name)
+
+
+def device_settings():
+    '''settings the device connections depend on'''
+    config = cfg.get_config()
+    return [sorted(config.items(section)) for section in ('serial', 'arduino1', 'arduino2')
+            if config.has_section(section)] + \
+        [cfg.get_setting("acquisition", "switch_delay", fallback='0.1')]
+
+
+def connect_devices():
+    '''arduinos and LCR meter connections, kept open between back-to-back
+       jobs (see release_devices) unless their settings changed.
+       Returns lcr, arduinos and whether they were already connected'''
+    settings = device_settings()
+    if devices and devices['settings'] != settings:
+        release_devices()
+    if devices:
+        return devices['lcr'], devices['arduinos'], True
+
+    # configure and connect all required arduinos
+    arduinos = arduinos_connect(cfg)
+
+    # LCR TH2816B serial connection, the boards must not stay open (port
+    # in use for the next jobs) if it fails
+    try:
         lcr = SerialConnection(cfg)
+    except BaseException:
+        shutdown(None, arduinos)
+        raise
+    devices.update(settings=settings, lcr=lcr, arduinos=arduinos)
 
-        # run the experiment
-        data = []
-        try:
-            data = run_experiment(lcr, arduinos, **params)
-        except Exception as exp:
-            print(str(exp))
-        finally:
-            shutdown(lcr, arduinos)
+    return lcr, arduinos, False
 
-        # subdirectories to create
-        topdir = None
-        subdirs = ['primary', 'secondary']
 
-        # get experiment name from form and write to file
-        exp_name = str(self.get_body_arguments('exp_name')[0])
-        username = str(self.get_body_arguments('username')[0])
-        if len(exp_name) < 1:
-            exp_name = 'No desc'
-        if len(username) < 1:
-            username = ''
-        else:
-            topdir = username
+def release_devices():
+    '''turn off and disconnect the devices (job queue idle)'''
+    if devices:
+        shutdown(devices['lcr'], devices['arduinos'])
+        devices.clear()
 
-        # create output directory and subdirectories
-        output_dir = create_output_dir(topdir, subdirs)
-        try:
-            with open(os.path.join(output_dir, 'desc.txt'), 'w', encoding='UTF-8') as fp:
-                fp.write(exp_name)
-        except Exception as exp:
-            print("ERROR: Unable to write experiment description to file")
-            os._exit(os.EX_CONFIG)
 
-        # save all collected data to a single json file
-        with open(os.path.join(output_dir, 'results.json'), 'w', encoding='ISO-8859-1') as outfile:
-            json.dump(data, outfile, indent=2, ensure_ascii=True)
+def finish_experiment(output_dir, username, exp_name):
+    '''results of an experiment, run while the next one is acquiring'''
+    # everything read up to a crash or cancel is in the readings file,
+    # convert it to the columnar results store
+    storage.write_columnar(output_dir, remove_stream=True)
 
-        # save each sensor data to a separate csv file
-        self.write_each_sensor(data, output_dir)
+    # save each sensor and all sensors of each valve to csv files
+    exporter.export_results(output_dir)
 
-        # save all sensor data to a single csv file
-        self.write_all_sensors(data, output_dir)
+    # finally update index files with new contents
+    # (plots are rendered on request, see PlotHandler)
+    exporter.update_output_dir(BASE_EXP_DIR)
 
-        # finally update index files with new contents
-        self.update_output_dir()
-        
-        # force tornado reload after index.html change
-        self._reload()
+    # searchable without walking the experiments dir
+    try:
+        catalog.add(output_dir, user=username, description=exp_name)
+    except Exception as exp:
+        cprint.warn(f'Unable to add the experiment to the catalog: {exp}')
+    cprint.success(f'Experiment data saved to {output_dir}')
 
-    def _reload(self):
-        try:
-            with open('reload', 'w') as f:
-                f.write('Change this file in order to force a tornado reload!!')
-        except:
-            pass
 
 def create_output_dir(topdir=None, subdirs=None):
     '''create data output directory'''
@@ -399,9 +742,14 @@ def create_output_dir(topdir=None, subdirs=None):
     base_dir = BASE_EXP_DIR if topdir is None else os.path.join(
         BASE_EXP_DIR, topdir)
 
-    # date and time as subdirectory
-    timestr = time.strftime("%Y-%m-%d %Hh%Mm%Ss")
-    output_dir = os.path.abspath(os.path.join(SCRIPT_DIR, base_dir, timestr))
+    # date and time as subdirectory (back-to-back experiments must not
+    # share the same second)
+    while True:
+        timestr = time.strftime("%Y-%m-%d %Hh%Mm%Ss")
+        output_dir = os.path.abspath(os.path.join(SCRIPT_DIR, base_dir, timestr))
+        if not os.path.exists(output_dir):
+            break
+        time.sleep(0.5)
 
     # create output directory if not exists
     if not os.path.exists(output_dir):
@@ -426,8 +774,8 @@ def create_output_dir(topdir=None, subdirs=None):
 
 
 def autoreload_wait(secs=3):
-    '''sleep for a given number of seconds'''
-    shutdown(lcr, arduinos)
+    '''stop the running experiment (if any) and sleep for a given number of seconds'''
+    job_queue.stop()
     time.sleep(secs)
 
 
@@ -443,9 +791,23 @@ if __name__ == '__main__':
     cfg = mycfg.MyConfig(CFGFN)
     ser_params, web_params = cfg.read_config()
 
-    # global devices variables
-    lcr = None
-    arduinos = []
+    # on demand plot rendering, plotly.js is served from /static
+    plotlyjs = exporter.install_plotlyjs(
+        os.path.join(SCRIPT_DIR, 'static', 'js'))
+    renderer = exporter.PlotRenderer.from_config(
+        cfg, log=cprint, plotlyjs=f'/static/js/{plotlyjs}')
+    plot_cache = exporter.PlotCache.from_config(cfg)
+
+    # live readings to the web browsers
+    broadcaster = livestream.Broadcaster()
+
+    # experiments catalog, existing experiments are added with catalog.py
+    catalog = catalogdb.Catalog(os.path.join(SCRIPT_DIR, catalogdb.CATALOG_FILE),
+                                os.path.join(SCRIPT_DIR, BASE_EXP_DIR))
+
+    # experiments queue, queued experiments survive a restart
+    job_queue = jobs.JobQueue(os.path.join(SCRIPT_DIR, jobs.JOBS_FILE),
+                              run_job, log=cprint, idle=release_devices)
 
     # tornado setup
     handlers = [
@@ -453,8 +815,15 @@ if __name__ == '__main__':
         (r"/page", PageHandler),
         (r"/form", FormHandler),
         (r"/ajax", AjaxHandler),
-        (r"/static/(.*)", tornado.web.StaticFileHandler,
+        (r"/ws", LiveHandler),
+        (r"/listing/?(.*)", ListingHandler, {'path': f'./{BASE_EXP_DIR}'}),
+        (r"/catalog/?(.*)", CatalogHandler),
+        (r"/jobs/?(\d*)/?(move|cancel)?", JobsHandler),
+        (r"/data/(.+)", DataHandler, {'path': f'./{BASE_EXP_DIR}'}),
+        (r"/static/(.*)", StaticHandler,
          {'path': './static'}),
+        (fr"/{BASE_EXP_DIR}/(.+)/(primary|secondary)/(V\d+(?:-S\d+)?)\.(html|json)",
+         PlotHandler, {'path': f'./{BASE_EXP_DIR}'}),
         (fr"/{BASE_EXP_DIR}/(.*)", tornado.web.StaticFileHandler,
          {'path': f'./{BASE_EXP_DIR}', "default_filename": "index.html"}),
     ]
@@ -482,16 +851,22 @@ if __name__ == '__main__':
             tornado.autoreload.watch(watched_file)
         # wait a little bit before reloading tornado server
         tornado.autoreload.add_reload_hook(autoreload_wait)
+        # the reloaded process replaces this one without running atexit
+        tornado.autoreload.add_reload_hook(cprint.flush)
 
     # tornado main loop
     main_loop = tornado.ioloop.IOLoop().current()
 
     # start tornado main loop
     try:
+        broadcaster.start()
+        job_queue.start()
         main_loop.start()
     except Exception as exp:
         pass
     finally:
-        shutdown(lcr, arduinos)
+        job_queue.stop()
+        renderer.shutdown(wait=False)
         http_server.stop()
+        cprint.close()
         print('\nWeb server stopped!')